@@ -1,21 +1,26 @@
 # coding=utf-8
 
 import datetime as dt
+import threading
 import webapp2
 from urllib import urlencode
-from google.appengine.ext.webapp import template
 from google.appengine.api import mail
-from signupVerifier.io.gclient import GClient, spreadsheet_id, worksheet_id
-from signupVerifier.io.utils import tryXTimes
+from google.appengine.api import taskqueue
+from signupVerifier.io.gclient import GClient, spreadsheet_id
+from signupVerifier.io.cache import ResourceCache
+from signupVerifier.io.utils import tryXTimes, runConcurrently, RateLimiter
 from signupVerifier.processors.initial_processor import importBatch,\
-    importPerson, addBatchChange, addPersonChange, sendVerificationEmails
-from signupVerifier.processors.optout_processor import createOptOutToken,\
+    addBatchChange, importPersonsBulk, sendVerificationEmails
+from signupVerifier.processors.optout_processor import \
     removeAllOptOutTokensFromBatches
 from signupVerifier.processors.final_processor import getSuccessfulSignups,\
     personsToCsv, emailCsvs
-from signupVerifier.models import Person
+from signupVerifier.processors.backfill_processor import backfillPersonStatus
+from signupVerifier.models import Person, DriveSyncState
 from signupVerifier.settings import settings
+from signupVerifier.template_registry import templates
 from django.template.defaultfilters import slugify
+from gdata.client import RequestError
 
 import logging
 
@@ -26,10 +31,47 @@ optout_confirm_template = 'templates/optout_confirm.html'
 followup_template = 'templates/emails/followup_template.html'
 followup_template_text = 'templates/emails/followup_template.txt'
 
+# Number of spreadsheets processed at once by the initial script, unless the
+# workers parameter is provided
+initial_workers = 4
+
+# Number of verification emails sent at once for each spreadsheet, and the
+# maximum number sent per second across all spreadsheets (None for no limit),
+# unless the email_workers and email_rate parameters are provided
+verification_email_workers = 5
+verification_email_rate = None
+
 spreadsheet_export_url = \
     'https://spreadsheets.google.com/feeds/download/spreadsheets/Export'
 
 
+def new_batch_log(meta_dict, spreadsheet_url, spreadsheet_title):
+    return {'meta_dict': meta_dict, 'spreadsheet_url': spreadsheet_url,
+            'spreadsheet_title': spreadsheet_title, 'error': None,
+            'persons_success': [], 'persons_fail': [],
+            'errors_sheet_url': None, 'errors_sheet_title': None}
+
+
+def positiveParam(request, name, default, cast=int):
+    """
+    Returns the value of the provided query parameter cast to a positive
+    number, or default if the parameter is missing. An invalid value is
+    logged and default is used instead, rather than failing the request.
+    """
+    value = request.get(name)
+    if not value:
+        return default
+    try:
+        number = cast(value)
+    except ValueError:
+        number = None
+    if number is None or number <= 0:
+        logging.warning('Invalid %s parameter %r, using %s instead' %
+                        (name, value, default))
+        return default
+    return number
+
+
 def build_xlsx_download_link(gsid):
     params = urlencode({'key': gsid, 'exportFormat': 'xlsx'})
     return '?'.join([spreadsheet_export_url, params])
@@ -43,189 +85,229 @@ class SpreadsheetInitialPage(webapp2.RequestHandler):
     def __init__(self, request, response):
         # webapp2 uses initialize instead of __init__, cause it's special
         self.initialize(request, response)
-        self.__gclient__ = None
+        # Spreadsheets may be processed by several threads at once, and
+        # GClient is not thread safe, so each thread gets its own. They share
+        # one resource cache, so that resources fetched by one thread are not
+        # fetched again by the others, and its counters cover every thread.
+        self.__local__ = threading.local()
+        self.__resourceCache__ = ResourceCache()
 
     @property
     def gclient(self):
-        if self.__gclient__ is None:
-            self.__gclient__ = GClient()
+        if getattr(self.__local__, 'gclient', None) is None:
+            self.__local__.gclient = GClient(self.__resourceCache__)
 
-        assert self.__gclient__
-        return self.__gclient__
+        assert self.__local__.gclient
+        return self.__local__.gclient
 
     def get(self):
         logging.info('Running Initial Script')
-        # 0.) Setup output lists
-        batch_logs = []
-
-        def new_batch_log(meta_dict, spreadsheet_url, spreadsheet_title):
-            return {'meta_dict': meta_dict, 'spreadsheet_url': spreadsheet_url,
-                    'spreadsheet_title': spreadsheet_title, 'error': None,
-                    'persons_success': [], 'persons_fail': [],
-                    'errors_sheet_url': None, 'errors_sheet_title': None}
 
-        # 1.) Get list of all spreadsheets in folder
-        signups_folder = tryXTimes(
-            lambda: self.gclient.docsClient.GetResourceById(
-                settings['signups_folder_id']))
-        spreadsheets = self.gclient.spreadsheets(signups_folder)
+        # 1.) Get list of the spreadsheets in folder changed since the last
+        # run, or of all of them if the full parameter is provided or the
+        # folder has not been crawled in full yet
+        signups_folder = self.gclient.getResourceById(
+            settings['signups_folder_id'])
+        sync_state = DriveSyncState.forFolder(settings['signups_folder_id'])
+        if self.request.get('full') or sync_state.changestamp is None:
+            # Taken before the crawl, so that changes made during it are
+            # looked at by the next run
+            changestamp = self.gclient.largestChangestamp()
+            spreadsheets = list(self.gclient.spreadsheets(signups_folder))
+        else:
+            spreadsheets, changestamp = self.gclient.changedSpreadsheets(
+                signups_folder, sync_state.changestamp)
+
+        # Spreadsheets that failed last run are tried again, even though
+        # Drive's changes feed has moved past them
+        found_gsids = set(spreadsheet_id(spreadsheet)
+                          for spreadsheet in spreadsheets)
+        for gsid in sync_state.retry_gsids:
+            if gsid in found_gsids:
+                continue
+            try:
+                spreadsheets.append(self.gclient.getResourceById(gsid))
+            except RequestError as e:
+                logging.warning('Could not look up spreadsheet %s to retry: '
+                                '%s' % (gsid, e))
 
         # 2.) Discard from that list all spreadsheets already processed
         new_spreadsheets = self.gclient.filterOutOldSpreadsheets(spreadsheets)
 
-        # 3.) Process the remaining spreadsheets
-        logging.info('%s new spreadsheets to process' % len(new_spreadsheets))
-        for new_spreadsheet in new_spreadsheets:
-
-            batch = None
-            batchSpreadsheet = None
-            logging.info('Processing %s' % new_spreadsheet.title.text)
-            try:
-                #  1.) Convert spreadsheets meta info to batch_dict
-                meta_list_feed = self.gclient.getMetaListFeed(new_spreadsheet)
-                if not meta_list_feed:
-                    raise LookupError('Coversheet contains no data')
-                meta_dict = self.gclient.metaRowToDict(meta_list_feed[0])
-
-                # 2.) Import meta_dict into Batch table
-                if 'prev_batch' in meta_dict:
-                    batch = addBatchChange(meta_dict, meta_dict['prev_batch'])
-                    meta_dict = batch.asDict()
-                    batchSpreadsheet = self.gclient.importBatchSpreadsheet(
-                        batch, new_spreadsheet)
-                else:
-                    batch = importBatch(meta_dict)
-
-                    batchSpreadsheet = self.gclient.importBatchSpreadsheet(
-                        batch, new_spreadsheet)
-            except Exception as e:
-                # Something serious has happened. Need to piece together a
-                # batch_log for the tech guy and undo any changes to the DB
-                if batch and batch.is_saved():
-                    batch.delete()
-                if batchSpreadsheet and batchSpreadsheet.is_saved():
-                    batchSpreadsheet.delete()
-
-                logging.exception(e)
-                batch_log = new_batch_log(
-                    {
-                        'staff_email': settings['admin_email_address'],
-                        'event_name': 'ERROR',
-                        'event_date': 'ERROR'
-                    }, new_spreadsheet.FindHtmlLink(),
-                    new_spreadsheet.title.text)
-                batch_logs.append(batch_log)
-                batch_log['error'] = e
-                continue
+        # 3.) Process the remaining spreadsheets, several at a time
+        workers = positiveParam(self.request, 'workers', initial_workers)
+        email_workers = positiveParam(self.request, 'email_workers',
+                                      verification_email_workers)
+        email_rate = positiveParam(self.request, 'email_rate',
+                                   verification_email_rate, float)
+        # The mail quota is app wide, so the spreadsheets processed at once
+        # share one limiter rather than each sending at email_rate
+        email_limiter = RateLimiter(email_rate) if email_rate else None
+        logging.info('%s new spreadsheets to process with %s workers' %
+                     (len(new_spreadsheets), workers))
+        batch_logs = runConcurrently(
+            lambda spreadsheet: self.processSpreadsheet(
+                spreadsheet, email_workers, email_limiter),
+            new_spreadsheets, workers)
+
+        # Remember how far Drive's changes have been looked at, and which
+        # spreadsheets failed, so that only they are tried again next run
+        sync_state.changestamp = changestamp
+        sync_state.retry_gsids = [
+            spreadsheet_id(spreadsheet) for spreadsheet, batch_log
+            in zip(new_spreadsheets, batch_logs) if batch_log['error']]
+        sync_state.put()
+
+        # 4.) Process the batch_logs
+        retval = self.emailStaff(batch_logs)
+        templates.logCounters()
+        self.gclient.resourceCache.logCounters()
+        self.response.headers['Content-Type'] = 'text/html'
+        self.response.write(retval)
 
-            # Create a batch log for the new batch
-            batch_log = new_batch_log(meta_dict,
-                                      new_spreadsheet.FindHtmlLink(),
-                                      new_spreadsheet.title.text)
-            batch_logs.append(batch_log)
+    def processSpreadsheet(self, new_spreadsheet,
+                           email_workers=verification_email_workers,
+                           email_limiter=None):
+        """
+        Imports the batch and persons of the provided new spreadsheet and sends
+        the persons their verification emails. Safe to run in several threads
+        at once, for different spreadsheets.
+
+        Input:  new_spreadsheet - a Resource instance of a spreadsheet that has
+                                  not been processed yet
+                email_workers - the number of verification emails to send at
+                                once
+                email_limiter - optional RateLimiter of the verification
+                                emails, shared by all spreadsheets
+        Output: the batch_log of the spreadsheet
+        """
+        batch = None
+        batchSpreadsheet = None
+        logging.info('Processing %s' % new_spreadsheet.title.text)
+        try:
+            #  1.) Convert spreadsheets meta info to batch_dict
+            meta_list_feed = self.gclient.getMetaListFeed(new_spreadsheet)
+            if not meta_list_feed:
+                raise LookupError('Coversheet contains no data')
+            meta_dict = self.gclient.metaRowToDict(meta_list_feed[0])
 
-            # 3.) Convert and import persons and create OptOutTokens
             # Make sure the first row of the Raw sheet is the header row we
             # want, since sometimes meta headers are placed in these
-            # spreadsheets
-            while not self.gclient.isFirstRawRowValid(new_spreadsheet):
-                self.gclient.deleteFirstRawRow(new_spreadsheet)
-
-            person_list_feed = self.gclient.getRawListFeed(new_spreadsheet)
-
-            persons = []
-            optout_tokens = dict()
-            validations_spreadsheet = None
-            validations_worksheet = None
-            validations_listfeed = None
-            error_i = 0
-            for person_list_entry in person_list_feed:
-                # Because of how the Full Name column is a formula output that
-                # always includes an empty space, we need to first check that
-                # several values exist to be sure that the row is actually data
-                # entered by a user.
-
-                if ((person_list_entry.get_value('email') is None or
-                     not person_list_entry.get_value('email').strip()) and
-                    (person_list_entry.get_value('firstname') is None or
-                     not person_list_entry.get_value('firstname').strip())
-                    and
-                    (person_list_entry.get_value('lastname') is None or
-                     not person_list_entry.get_value('lastname').strip())
-                    and
-                    (person_list_entry.get_value('fullname') is None or
-                     not person_list_entry.get_value('fullname').strip())):
-                    continue
-
+            # spreadsheets. Raises a LookupError, recorded in the batch_log,
+            # if there is no header row at all.
+            self.gclient.fixRawHeaderRow(new_spreadsheet)
+
+            # 2.) Import meta_dict into Batch table
+            if 'prev_batch' in meta_dict:
+                batch = addBatchChange(meta_dict, meta_dict['prev_batch'])
+                meta_dict = batch.asDict()
+                batchSpreadsheet = self.gclient.importBatchSpreadsheet(
+                    batch, new_spreadsheet)
+            else:
+                batch = importBatch(meta_dict)
+
+                batchSpreadsheet = self.gclient.importBatchSpreadsheet(
+                    batch, new_spreadsheet)
+        except Exception as e:
+            # Something serious has happened. Need to piece together a
+            # batch_log for the tech guy and undo any changes to the DB
+            if batch and batch.is_saved():
+                batch.delete()
+            if batchSpreadsheet and batchSpreadsheet.is_saved():
+                batchSpreadsheet.delete()
+
+            logging.exception(e)
+            batch_log = new_batch_log(
+                {
+                    'staff_email': settings['admin_email_address'],
+                    'event_name': 'ERROR',
+                    'event_date': 'ERROR'
+                }, new_spreadsheet.FindHtmlLink(),
+                new_spreadsheet.title.text)
+            batch_log['error'] = e
+            return batch_log
+
+        # Create a batch log for the new batch
+        batch_log = new_batch_log(meta_dict,
+                                  new_spreadsheet.FindHtmlLink(),
+                                  new_spreadsheet.title.text)
+        # Any later failure is recorded in the batch_log too, rather than
+        # failing the whole run. Persons may have been imported and emailed
+        # by then, so the batch is kept.
+        try:
+            # 3.) Convert and import persons and create OptOutTokens
+            person_rows = self.gclient.getRawRows(new_spreadsheet)
+            normalized_rows = []
+            if person_rows:
+                normalizer = self.gclient.personRowNormalizer(
+                    person_rows[0].columns)
+                normalized_rows = normalizer.normalize(person_rows)
+
+            person_dicts = []
+            invalid_rows = []
+            for person_row, person_dict, validation_errors in normalized_rows:
                 batch.submitted_persons += 1
 
                 # Make sure we have some level of valid data
-                validation_errors = self.gclient.invalidPersonRow(
-                    person_list_entry)
                 if validation_errors:
                     batch.invalid_persons += 1
-                    # Need to patch together a dict on an error.
-                    # Blug, this is ugly
                     errors_str = '; '.join(validation_errors)
                     batch_log['persons_fail'].append((
                         {
-                            'email': person_list_entry.get_value('email'),
-                            'full_name': person_list_entry
-                            .get_value('fullname')
+                            'email': person_dict.get('email'),
+                            'full_name': person_dict.get('full_name')
                         }, errors_str))
-
-                    # TODO Add the row to a spreadsheet for validation errors,
-                    # and create that spreadsheet if it doesn't exist.
-                    if not validations_listfeed:
-                        validations_spreadsheet, validations_worksheet = \
-                            self.gclient.createValidationErrorsSpreadsheet(
-                                batch)
-                        vgsid = spreadsheet_id(validations_spreadsheet)
-                        vwsid = worksheet_id(validations_worksheet)
-                        validations_listfeed = tryXTimes(
-                            lambda:
-                            self.gclient.spreadsheetsClient.GetListFeed(
-                                vgsid, vwsid).entry)
-                        batch_log['errors_sheet_url'] =\
-                            validations_spreadsheet.FindHtmlLink()
-                        batch_log['errors_sheet_title'] =\
-                            validations_spreadsheet.title.text
-
-                    logging.debug('Accessing row # %s' % error_i)
-                    error_entry = validations_listfeed[error_i]
-                    error_i += 1
-                    error_entry.from_dict(person_list_entry.to_dict())
-                    error_entry.set_value('errors', errors_str)
-                    tryXTimes(lambda: self.gclient.spreadsheetsClient.Update(
-                        error_entry, force=True))
+                    invalid_rows.append((person_row, validation_errors))
                     continue
 
-                person_dict = self.gclient.personRowToDict(person_list_entry)
-                try:
-                    if 'person_id' in person_dict:
-                        person_dict['source_batch'] = batch.key()
-                        person = addPersonChange(
-                            person_dict,
-                            person_dict['person_id'])
-                    else:
-                        person = importPerson(person_dict, batch)
-
-                    persons.append(person)
-                    optout_tokens[person.key()] = createOptOutToken(batch,
-                                                                    person)
-                except Exception as e:
-                    logging.exception(e)
-                    batch_log['persons_fail'].append((person_dict, e))
+                person_dicts.append(person_dict)
+
+            # Add all of the invalid rows to a spreadsheet for validation
+            # errors, written with batched cell updates
+            if invalid_rows:
+                validations_spreadsheet, validations_worksheet = \
+                    self.gclient.createValidationErrorsSpreadsheet(batch)
+                self.gclient.writeInvalidPersonRows(validations_spreadsheet,
+                                                    validations_worksheet,
+                                                    invalid_rows)
+                batch_log['errors_sheet_url'] =\
+                    validations_spreadsheet.FindHtmlLink()
+                batch_log['errors_sheet_title'] =\
+                    validations_spreadsheet.title.text
+
+            # Import all of the valid persons and create their OptOutTokens
+            # with as few Datastore round trips as possible
+            persons, optout_tokens = importPersonsBulk(person_dicts, batch,
+                                                       batch_log)
 
             # 4.) Generate and send Emails!
             optout_base_url = '/'.join([self.request.host_url, 'optout'])
             batch_log = sendVerificationEmails(
-                batch, persons, optout_tokens, optout_base_url, batch_log)
+                batch, persons, optout_tokens, optout_base_url, batch_log,
+                concurrency=email_workers, rate_limit=email_limiter)
 
             # Save the model with updated tracking
             batch.put()
+        except Exception as e:
+            logging.exception(e)
+            batch_log['error'] = e
+            # Keep the tracking counted before the failure
+            try:
+                batch.put()
+            except Exception as put_error:
+                logging.exception(put_error)
+
+        return batch_log
+
+    def emailStaff(self, batch_logs):
+        """
+        Sends each staff person a summary of the results of processing the
+        spreadsheets they submitted.
 
-        # Process the batch_logs
+        Input:  batch_logs - a list of batch_logs, one per processed
+                             spreadsheet
+        Output: the html of the sent emails
+        """
         staff_templates = dict()
         for batch_log in batch_logs:
             if 'staff_email' not in batch_log['meta_dict']:
@@ -290,8 +372,8 @@ class SpreadsheetInitialPage(webapp2.RequestHandler):
 
         retval = ''
         for email, template_values in staff_templates.iteritems():
-            email_html = template.render(initial_template, template_values)
-            email_text = template.render(
+            email_html = templates.render(initial_template, template_values)
+            email_text = templates.render(
                 initial_template_text, template_values)
             message = mail.EmailMessage(
                 sender=settings['app_email_address'],
@@ -305,8 +387,9 @@ class SpreadsheetInitialPage(webapp2.RequestHandler):
             logging.info('Emailed %s' % email)
 
             retval += email_html
-        self.response.headers['Content-Type'] = 'text/html'
-        self.response.write(retval)
+
+        return retval
+
 
 from bounce_handler import BounceHandler
 from google.appengine.ext.webapp.mail_handlers import BounceNotification
@@ -460,8 +543,9 @@ class SpreadsheetFollowupPage(webapp2.RequestHandler):
         retval = ""
         for staff_address, followup in staff_followups.iteritems():
             if followup['optouts'] or followup['bounces']:
-                email_html = template.render(followup_template, followup)
-                email_text = template.render(followup_template_text, followup)
+                email_html = templates.render(followup_template, followup)
+                email_text = templates.render(followup_template_text,
+                                              followup)
                 message = mail.EmailMessage(
                     sender=settings['app_email_address'],
                     subject=settings['subject_followup_staff'])
@@ -499,14 +583,41 @@ class SpreadsheetFollowupPage(webapp2.RequestHandler):
         emailCsvs(csvs, batches)
 
         logging.info('Emailed CSVs')
+        templates.logCounters()
+        self.gclient.resourceCache.logCounters()
 
         self.response.headers['Content-Type'] = 'text/html'
         self.response.write(retval)
 
+
+class BackfillPersonStatusPage(webapp2.RequestHandler):
+    """
+    Sets the denormalized status flags of every existing Person. Each request
+    backfills one page of Persons, then queues a task to backfill the next.
+    """
+
+    def get(self):
+        self.handleRequest()
+
+    def post(self):
+        self.handleRequest()
+
+    def handleRequest(self):
+        cursor = backfillPersonStatus(self.request.get('cursor') or None)
+        if cursor:
+            taskqueue.add(url='/backfill_person_status',
+                          params={'cursor': cursor})
+        else:
+            logging.info('Finished backfilling Person status')
+
+        self.response.headers['Content-Type'] = 'text/plain'
+        self.response.write('Next cursor: %s' % cursor)
+
 routes = [
     ('/spreadsheet_initial', SpreadsheetInitialPage),
     ('/test_bounce', TestBouncePage),
-    ('/spreadsheet_followup', SpreadsheetFollowupPage)
+    ('/spreadsheet_followup', SpreadsheetFollowupPage),
+    ('/backfill_person_status', BackfillPersonStatusPage)
 ]
 
 app = webapp2.WSGIApplication(routes=routes, debug=True)
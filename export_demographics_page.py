@@ -2,7 +2,13 @@ import webapp2
 from signupVerifier.settings import settings
 from signupVerifier.models.models import Person
 from signupVerifier.processors.unicode_csv import UnicodeDictWriter
-from StringIO import StringIO
+from signupVerifier.processors.backfill_processor import \
+    isPersonStatusBackfilled, startPersonStatusBackfill, setPersonStatus
+
+import logging
+
+# Number of Persons fetched from the Datastore per page of the export
+PAGE_SIZE = 300
 
 
 class ExportDemographicsPage(webapp2.RequestHandler):
@@ -14,31 +20,54 @@ class ExportDemographicsPage(webapp2.RequestHandler):
         self.handleRequest()
 
     def handleRequest(self):
-        csv_buffer = StringIO()
-        columns = settings['demographics_column_order']
-        columns.extend(['bounced', 'opted_out'])
-        dict_writer = UnicodeDictWriter(csv_buffer,
+        # Persons are fetched and converted a page at a time, so only one page
+        # of models is held at once. webapp2 still buffers the response until
+        # the handler returns, so the whole CSV is held in memory and the
+        # response size and deadline limits still apply.
+        self.response.headers['Content-Type'] = 'text/csv'
+        columns = settings['demographics_column_order'] + \
+            ['bounced', 'opted_out']
+        dict_writer = UnicodeDictWriter(self.response.out,
                                         columns,
                                         extrasaction='ignore')
         dict_writer.writeheader()
-        persons = Person.all()
-        persons = [person for person in persons
-                   if not person.next_changes.count()]
-        for person in persons:
-            person_dict = person.asDict()
-            person_dict['bounced'] = bool(person.bounces.count())
-            person_dict['opted_out'] = bool(person.optouts.count())
-            if person.born_out_of_us is not None and not person.born_out_of_us:
-                person_dict['born_out_of_us'] = 'False'
-            if person.parents_born_out_of_us is not None and\
-                    not person.parents_born_out_of_us:
-                person_dict['parents_born_out_of_us'] = 'False'
-            dict_writer.writerow(person_dict)
-
-        csv_string = csv_buffer.getvalue()
-        csv_buffer.close()
-        self.response.headers['Content-Type'] = 'text/csv'
-        self.response.write(csv_string)
+
+        # Persons saved before the status flags existed do not have them, so
+        # until they are backfilled, work the flags out for each page
+        backfilled = isPersonStatusBackfilled()
+        if not backfilled:
+            logging.warning('Person status has not been backfilled yet; '
+                            'working it out for each Person')
+            startPersonStatusBackfill()
+
+        cursor = None
+        while True:
+            q = Person.all()
+            if backfilled:
+                q.filter('superseded =', False)
+            if cursor:
+                q.with_cursor(cursor)
+            persons = q.fetch(PAGE_SIZE)
+            if not persons:
+                break
+            if not backfilled:
+                setPersonStatus(persons)
+
+            for person in persons:
+                if person.superseded:
+                    continue
+                person_dict = person.asDict()
+                if person.born_out_of_us is not None and \
+                        not person.born_out_of_us:
+                    person_dict['born_out_of_us'] = 'False'
+                if person.parents_born_out_of_us is not None and\
+                        not person.parents_born_out_of_us:
+                    person_dict['parents_born_out_of_us'] = 'False'
+                dict_writer.writerow(person_dict)
+
+            if len(persons) < PAGE_SIZE:
+                break
+            cursor = q.cursor()
 
 
 routes = [webapp2.Route('/export_demographics.csv',
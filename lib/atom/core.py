@@ -22,6 +22,9 @@ __author__ = 'j.s@google.com (Jeff Scudder)'
 
 
 import inspect
+import StringIO
+import threading
+import types
 try:
   from xml.etree import cElementTree as ElementTree
 except ImportError:
@@ -40,13 +43,158 @@ except ImportError:
     xmlString = None
 
 STRING_ENCODING = 'utf-8'
+# The approximate size in bytes of the chunks returned by
+# XmlElement.to_chunks.
+CHUNK_SIZE = 64 * 1024
+XML_NAMESPACE = 'http://www.w3.org/XML/1998/namespace'
+# The number of qnames after which the caches of split and prefixed qnames are
+# cleared. Documents like list feeds contain qnames made from user data, so
+# the caches must not grow without bound.
+MAX_CACHED_QNAMES = 10000
+# The number of namespaces given a prefix shared by all documents. Namespaces
+# beyond these get a prefix for the document being written only.
+MAX_SHARED_PREFIXES = 1000
+
+
+def _is_member_spec(name, member_type):
+  """Indicates whether a class attribute declares an XML member.
+
+  See XmlElement._list_xml_members for the kinds of declarations.
+  """
+  return (not name.startswith('_') and name != 'text'
+          and (isinstance(member_type, (tuple, list, str, unicode))
+               or (inspect.isclass(member_type)
+                   and issubclass(member_type, XmlElement))))
+
+
+class _EmptyAttributes(dict):
+  """The shared, read only _other_attributes of compact elements."""
+
+  def _read_only(self, *args, **kwargs):
+    raise TypeError('Use XmlElement._writable_other_attributes()')
+
+  __setitem__ = __delitem__ = clear = pop = popitem = _read_only
+  setdefault = update = _read_only
+
+
+_EMPTY_ATTRIBUTES = _EmptyAttributes()
+
+
+class _EmptyElements(tuple):
+  """The shared, read only _other_elements of compact elements."""
+
+  def _read_only(self, *args, **kwargs):
+    raise TypeError('Use XmlElement._writable_other_elements()')
+
+  append = extend = insert = remove = pop = sort = reverse = _read_only
+
+
+_EMPTY_ELEMENTS = _EmptyElements()
+
+
+class _CompactQname(object):
+  """The _qname of a compact element which declares a '_qname' slot.
+
+  Reading it from the class gives the _qname declared in the class body.
+  Instances have that qname until they are given their own, which is stored
+  in the _instance_qname slot.
+  """
+
+  def __init__(self, default, slot):
+    self.default = default
+    self.slot = slot
+
+  def __get__(self, instance, owner):
+    if instance is None:
+      return self.default
+    try:
+      return self.slot.__get__(instance, owner)
+    except AttributeError:
+      return self.default
+
+  def __set__(self, instance, value):
+    self.slot.__set__(instance, value)
+
+
+class _XmlElementType(type):
+  """Metaclass of XmlElement, which builds the slots of compact elements.
+
+  A class which sets _compact to True, or inherits it, stores its XML
+  members and text in __slots__ instead of an instance __dict__. The member
+  declarations in the class body are moved to _compact_members, since a
+  class attribute can not share its name with a slot, and
+  _list_xml_members looks them up there. Names listed in a __slots__ of the
+  class body get slots too; listing '_qname' lets each instance have its own
+  qname, as generic elements and gsx columns do.
+
+  The bases of XmlElement subclasses do not have __slots__, so instances of
+  compact elements can still be given other attributes, but the __dict__
+  holding them is only allocated when that happens.
+  """
+
+  def __new__(mcs, name, bases, namespace):
+    compact = namespace.get('_compact')
+    if compact is None:
+      compact = any(getattr(base, '_compact', False) for base in bases)
+    if not compact:
+      return type.__new__(mcs, name, bases, namespace)
+
+    own_members = dict((key, value) for key, value in namespace.iteritems()
+                       if _is_member_spec(key, value))
+    for key in own_members:
+      del namespace[key]
+    namespace['_compact_members'] = own_members
+    namespace.setdefault('_other_elements', _EMPTY_ELEMENTS)
+    namespace.setdefault('_other_attributes', _EMPTY_ATTRIBUTES)
+
+    slotted = set()
+    for base in bases:
+      for klass in inspect.getmro(base):
+        slotted.update(klass.__dict__.get('__slots__', ()))
+    slots = set(own_members)
+    slots.add('text')
+    for base in bases:
+      if hasattr(base, '_list_xml_members'):
+        slots.update(member_name for member_name, member_type
+                     in base._list_xml_members())
+    declared = namespace.get('__slots__', ())
+    if isinstance(declared, str):
+      declared = (declared,)
+    slots.update(declared)
+    qname = None
+    if '_qname' in slots:
+      slots.discard('_qname')
+      slots.add('_instance_qname')
+      if '_qname' in namespace:
+        qname = namespace.pop('_qname')
+      else:
+        qname = next((base._qname for base in bases
+                      if hasattr(base, '_qname')), None)
+    namespace['__slots__'] = tuple(sorted(slots - slotted))
+
+    cls = type.__new__(mcs, name, bases, namespace)
+    if '_instance_qname' in slots:
+      slot = next(klass.__dict__['_instance_qname']
+                  for klass in inspect.getmro(cls)
+                  if '_instance_qname' in klass.__dict__)
+      cls._qname = _CompactQname(qname, slot)
+    return cls
 
 
 class XmlElement(object):
   """Represents an element node in an XML document.
 
   The text member is a UTF-8 encoded str or unicode.
+
+  Subclasses which are instantiated in large numbers, such as the elements of
+  list feed rows, can set _compact to True. Their members and text are then
+  kept in __slots__ (see _XmlElementType), and their _other_elements and
+  _other_attributes are shared empty containers until something is added to
+  them. Add to them through _writable_other_elements and
+  _writable_other_attributes, or the extension_elements and
+  extension_attributes properties.
   """
+  __metaclass__ = _XmlElementType
   _qname = None
   _other_elements = None
   _other_attributes = None
@@ -54,13 +202,14 @@ class XmlElement(object):
   # appropriate member classes.
   _rule_set = None
   _members = None
+  _compact = False
   text = None
 
   def __init__(self, text=None, *args, **kwargs):
-    if ('_members' not in self.__class__.__dict__
-        or self.__class__._members is None):
-      self.__class__._members = tuple(self.__class__._list_xml_members())
-    for member_name, member_type in self.__class__._members:
+    cls = self.__class__
+    if '_members' not in cls.__dict__ or cls._members is None:
+      cls._members = tuple(cls._list_xml_members())
+    for member_name, member_type in cls._members:
       if member_name in kwargs:
         setattr(self, member_name, kwargs[member_name])
       else:
@@ -68,10 +217,13 @@ class XmlElement(object):
           setattr(self, member_name, [])
         else:
           setattr(self, member_name, None)
-    self._other_elements = []
-    self._other_attributes = {}
-    if text is not None:
+    if cls._compact:
       self.text = text
+    else:
+      self._other_elements = []
+      self._other_attributes = {}
+      if text is not None:
+        self.text = text
 
   def _list_xml_members(cls):
     """Generator listing all members which are XML elements or attributes.
@@ -89,14 +241,12 @@ class XmlElement(object):
         XML namespace of 'http://example.com/namespace'.
     """
     members = []
-    for pair in inspect.getmembers(cls):
-      if not pair[0].startswith('_') and pair[0] != 'text':
-        member_type = pair[1]
-        if (isinstance(member_type, tuple) or isinstance(member_type, list)
-            or isinstance(member_type, (str, unicode))
-            or (inspect.isclass(member_type)
-                and issubclass(member_type, XmlElement))):
-          members.append(pair)
+    for name, member_type in inspect.getmembers(cls):
+      if isinstance(member_type, types.MemberDescriptorType):
+        # The slot of a compact element, look for the member's declaration.
+        member_type = _compact_member(cls, name)
+      if _is_member_spec(name, member_type):
+        members.append((name, member_type))
     return members
 
   _list_xml_members = classmethod(_list_xml_members)
@@ -217,12 +367,44 @@ class XmlElement(object):
               matches.extend(member)
             else:
               matches.append(member)
-    for element in self._other_elements:
+    others = self._other_elements
+    if tag is not None and others:
+      others = self._get_other_elements_index().get(tag, ())
+    for element in others:
       if _qname_matches(tag, namespace, element._qname):
         matches.append(element)
     return matches
 
   GetElements = get_elements
+
+  # Lazily built index of _other_elements, see _get_other_elements_index.
+  _other_elements_index = None
+
+  def _get_other_elements_index(self):
+    """Returns a dict mapping local tags to the _other_elements with them.
+
+    The index is built the first time elements are looked up by tag, so that
+    later lookups only look at the elements with the right tag. It is
+    forgotten by _other_elements_changed, so _other_elements must only be
+    changed through _writable_other_elements or extension_elements.
+    """
+    index = self._other_elements_index
+    if index is None:
+      index = {}
+      for element in self._other_elements:
+        index.setdefault(_split_qname(_get_qname(element, 1))[1],
+                         []).append(element)
+      self._other_elements_index = index
+    return index
+
+  def _other_elements_changed(self):
+    """Forgets the indexes of _other_elements, since it may have changed.
+
+    Subclasses which index _other_elements themselves extend this to forget
+    their indexes too.
+    """
+    if self._other_elements_index is not None:
+      self._other_elements_index = None
   # FindExtensions and FindChildren are provided for backwards compatibility
   # to the atom.AtomBase class.
   # However, FindExtensions may return more results than the v1 atom.AtomBase
@@ -286,13 +468,13 @@ class XmlElement(object):
           setattr(self, definition[0], _xml_element_from_tree(element,
               definition[1], version))
       else:
-        self._other_elements.append(_xml_element_from_tree(element, XmlElement,
-                                                           version))
+        self._writable_other_elements().append(_xml_element_from_tree(
+            element, _OtherElement, version))
     for attrib, value in tree.attrib.iteritems():
       if attributes and attrib in attributes:
         setattr(self, attributes[attrib], value)
       else:
-        self._other_attributes[attrib] = value
+        self._writable_other_attributes()[attrib] = value
     if tree.text:
       self.text = tree.text
 
@@ -349,7 +531,7 @@ class XmlElement(object):
   def to_string(self, version=1, encoding=None, pretty_print=None):
     """Converts this object to XML."""
 
-    tree_string = ElementTree.tostring(self._to_tree(version, encoding))
+    tree_string = ''.join(self.to_chunks(version, encoding))
 
     if pretty_print and xmlString is not None:
         return xmlString(tree_string).toprettyxml()
@@ -358,6 +540,34 @@ class XmlElement(object):
  
   ToString = to_string
 
+  def to_chunks(self, version=1, encoding=None, chunk_size=CHUNK_SIZE):
+    """Converts this object to XML, split into chunks.
+
+    The XML is written straight into a buffer, without building an
+    ElementTree first. It is the same XML as _to_tree produces, but for the
+    prefixes of namespaces, and, like ElementTree.tostring, it is ASCII with
+    character references for other characters. As in ElementTree.tostring,
+    the namespaces used anywhere in the XML are declared on this element.
+
+    The whole document is still written before this returns, so the chunks
+    hold as much memory as the string of to_string would. What they save is
+    joining them into that string, and the copy this makes.
+
+    Args:
+      version: int (optional) The version of the XML rules to be used.
+      encoding: str (optional) The character encoding of str text and
+          attribute values. Default is 'UTF-8'.
+      chunk_size: int (optional) The approximate size of each chunk.
+
+    Returns:
+      A list of strs which together make up the XML.
+    """
+    writer = _XmlWriter(version, encoding or STRING_ENCODING, chunk_size)
+    writer.write_element(self)
+    return writer.close()
+
+  ToChunks = to_chunks
+
   def __str__(self):
     return self.to_string()
 
@@ -368,10 +578,47 @@ class XmlElement(object):
     new_child.tag = _get_qname(self, version)
     self._attach_members(new_child, version)
 
+  def _writable_other_elements(self):
+    """Returns _other_elements, allocating a list for it if it has none.
+
+    The indexes of _other_elements are forgotten, since the caller may
+    change it.
+    """
+    self._other_elements_changed()
+    others = self._other_elements
+    if not isinstance(others, list):
+      others = self._other_elements = list(others or ())
+    return others
+
+  def __getstate__(self):
+    """Returns the attributes of this element for pickle and copy.
+
+    The attributes kept in the __slots__ of compact elements are included,
+    so that they can be pickled with any protocol.
+    """
+    state = dict(getattr(self, '__dict__', ()))
+    for klass in inspect.getmro(self.__class__):
+      for name in klass.__dict__.get('__slots__', ()):
+        if name not in state and hasattr(self, name):
+          state[name] = getattr(self, name)
+    return state
+
+  def __setstate__(self, state):
+    for name, value in state.iteritems():
+      setattr(self, name, value)
+
+  def _writable_other_attributes(self):
+    """Returns _other_attributes, allocating a dict for it if it has none."""
+    others = self._other_attributes
+    if others is None or others is _EMPTY_ATTRIBUTES:
+      others = self._other_attributes = {}
+    return others
+
   def __get_extension_elements(self):
-    return self._other_elements
+    return self._writable_other_elements()
 
   def __set_extension_elements(self, elements):
+    self._other_elements_changed()
     self._other_elements = elements
 
   extension_elements = property(__get_extension_elements,
@@ -379,7 +626,7 @@ class XmlElement(object):
       """Provides backwards compatibility for v1 atom.AtomBase classes.""")
 
   def __get_extension_attributes(self):
-    return self._other_attributes
+    return self._writable_other_attributes()
 
   def __set_extension_attributes(self, attributes):
     self._other_attributes = attributes
@@ -391,15 +638,11 @@ class XmlElement(object):
   def _get_tag(self, version=1):
     qname = _get_qname(self, version)
     if qname:
-      return qname[qname.find('}')+1:]
+      return _split_qname(qname)[1]
     return None
 
   def _get_namespace(self, version=1):
-    qname = _get_qname(self, version)
-    if qname.startswith('{'):
-      return qname[1:qname.find('}')]
-    else:
-      return None
+    return _split_qname(_get_qname(self, version))[0]
 
   def _set_tag(self, tag):
     if isinstance(self._qname, tuple):
@@ -441,6 +684,299 @@ class XmlElement(object):
   attributes = extension_attributes
 
 
+class _OtherElement(XmlElement):
+  """An element which did not match any of the parsing rules of its parent.
+
+  These are the bulk of the elements of list feeds, one per cell, so they
+  are compact, with their qname in a slot.
+  """
+  _compact = True
+  __slots__ = ('_qname',)
+
+
+def _compact_member(cls, name):
+  """Finds the declaration of a member which a compact class made a slot.
+
+  Returns None if no class in the MRO of cls declares the member.
+  """
+  for klass in inspect.getmro(cls):
+    namespace = klass.__dict__
+    if name in namespace.get('_compact_members', ()):
+      return namespace['_compact_members'][name]
+    if (name in namespace
+        and not isinstance(namespace[name], types.MemberDescriptorType)):
+      return namespace[name]
+  return None
+
+
+# Prefixes of the namespaces seen so far when writing XML, see
+# _namespace_prefix. Prefixes are never removed, so that a namespace keeps its
+# prefix while a document using it is being written.
+_namespace_prefixes = {XML_NAMESPACE: 'xml'}
+_namespace_prefixes_lock = threading.Lock()
+
+
+def _namespace_prefix(namespace, local_prefixes):
+  """Returns the prefix for a namespace in the XML written by to_chunks.
+
+  The first MAX_SHARED_PREFIXES namespaces are each given a prefix the first
+  time they are written, which is then used for them in all documents. Later
+  namespaces are given a prefix in local_prefixes, a dict of the prefixes of
+  the document being written, which does not outlive the document.
+  """
+  try:
+    return _namespace_prefixes[namespace]
+  except KeyError:
+    pass
+  if namespace in local_prefixes:
+    return local_prefixes[namespace]
+  _namespace_prefixes_lock.acquire()
+  try:
+    if namespace not in _namespace_prefixes:
+      if len(_namespace_prefixes) >= MAX_SHARED_PREFIXES:
+        # Shared prefixes are numbered below MAX_SHARED_PREFIXES, so these
+        # can not clash with them.
+        local_prefixes[namespace] = 'ns%d' % (MAX_SHARED_PREFIXES +
+                                              len(local_prefixes))
+        return local_prefixes[namespace]
+      prefixes = set(_namespace_prefixes.itervalues())
+      n = len(_namespace_prefixes)
+      while 'ns%d' % n in prefixes:
+        n += 1
+      _namespace_prefixes[namespace] = 'ns%d' % n
+    return _namespace_prefixes[namespace]
+  finally:
+    _namespace_prefixes_lock.release()
+
+
+# Cache of the (namespace, prefixed name) pairs of qnames with a shared
+# namespace prefix, see _prefixed_qname.
+_prefixed_qnames = {}
+
+
+def _prefixed_qname(qname, local_prefixes):
+  """Returns the namespace of a qname and the name to write it with.
+
+  Args:
+    qname: str
+    local_prefixes: dict The namespace prefixes of the document being
+        written, see _namespace_prefix.
+  """
+  try:
+    return _prefixed_qnames[qname]
+  except KeyError:
+    pass
+  namespace, tag = _split_qname(qname)
+  if namespace is None:
+    prefixed = (None, tag)
+  else:
+    prefix = _namespace_prefix(namespace, local_prefixes)
+    prefixed = (namespace, '%s:%s' % (prefix, tag))
+    if namespace not in _namespace_prefixes:
+      return prefixed
+  if len(_prefixed_qnames) >= MAX_CACHED_QNAMES:
+    _prefixed_qnames.clear()
+  _prefixed_qnames[qname] = prefixed
+  return prefixed
+
+
+def _escape_text(text):
+  if '&' in text:
+    text = text.replace('&', '&amp;')
+  if '<' in text:
+    text = text.replace('<', '&lt;')
+  if '>' in text:
+    text = text.replace('>', '&gt;')
+  return text
+
+
+def _escape_attribute(value):
+  value = _escape_text(value)
+  if '"' in value:
+    value = value.replace('"', '&quot;')
+  if '\n' in value:
+    value = value.replace('\n', '&#10;')
+  return value
+
+
+# Cache of how to write the members of a class, by class and version, see
+# _write_plan.
+_write_plans = {}
+
+
+def _write_plan(cls, version):
+  """Returns how _XmlWriter writes the members of elements of a class.
+
+  Returns:
+    A tuple of the class' member attributes, as (qname, member name) pairs
+    sorted by qname, and its member elements, as (member name, repeating)
+    pairs in the order that _attach_members adds them.
+  """
+  key = (cls, version)
+  try:
+    return _write_plans[key]
+  except KeyError:
+    pass
+  ignored, elements, attributes = cls._get_rules(version)
+  plan = (sorted(attributes.iteritems()),
+          [(element_def[0], element_def[2])
+           for element_def in elements.itervalues()])
+  _write_plans[key] = plan
+  return plan
+
+
+class _XmlWriter(object):
+  """Writes XmlElements as XML into a list of chunks, see to_chunks.
+
+  Text and attribute values are written as strs in the encoding they were
+  given in, and only converted to ASCII with character references for the
+  chunks which need it. The start tag of the root element is only finished
+  when the writer is closed, so that it declares just the namespaces which
+  were written.
+  """
+
+  def __init__(self, version, encoding, chunk_size):
+    self.version = version
+    self.encoding = encoding
+    self.chunk_size = chunk_size
+    self.chunks = []
+    # Pieces of XML not yet converted, and the converted pieces not yet
+    # joined into a chunk.
+    self.parts = []
+    self.pending = []
+    self.pending_size = 0
+    # Prefixes of the namespaces without a shared one, see _namespace_prefix.
+    self.prefixes = {}
+    # The name of the root element, and the namespaces written so far.
+    self.root = None
+    self.namespaces = set()
+
+  def _str(self, value):
+    if isinstance(value, unicode):
+      return value.encode(self.encoding)
+    if isinstance(value, str):
+      return value
+    return str(value)
+
+  def _convert(self, parts):
+    data = ''.join(parts)
+    try:
+      data.decode('ascii')
+    except UnicodeDecodeError:
+      data = data.decode(self.encoding).encode('ascii', 'xmlcharrefreplace')
+    return data
+
+  def _flush(self, force=False):
+    if self.parts:
+      data = self._convert(self.parts)
+      del self.parts[:]
+      self.pending.append(data)
+      self.pending_size += len(data)
+    if self.pending and (force or self.pending_size >= self.chunk_size):
+      self.chunks.append(''.join(self.pending))
+      self.pending = []
+      self.pending_size = 0
+
+  def close(self):
+    """Returns the chunks of everything written."""
+    self._flush(True)
+    if self.root is not None:
+      head = ['<' + self.root]
+      self.namespaces.discard(XML_NAMESPACE)
+      for prefix, namespace in sorted(
+          (_namespace_prefix(namespace, self.prefixes), namespace)
+          for namespace in self.namespaces):
+        head.append(' xmlns:%s="%s"' % (
+            prefix, _escape_attribute(self._str(namespace))))
+      self.chunks[0] = self._convert(head) + self.chunks[0]
+    return self.chunks
+
+  def write_element(self, element):
+    """Writes an element and its members."""
+    version = self.version
+    write = self.parts.append
+    attribute_plan, element_plan = _write_plan(element.__class__, version)
+
+    qname = element._qname
+    if qname.__class__ is tuple:
+      qname = _get_qname(element, version)
+    if qname is None:
+      # Like ElementTree, write only the content of elements without a tag.
+      name = None
+    else:
+      namespace, name = _prefixed_qname(qname, self.prefixes)
+      if namespace is not None:
+        self.namespaces.add(namespace)
+
+      # Like _attach_members, leave out empty member attributes but not
+      # empty unexpected ones.
+      attributes = []
+      for attribute_qname, member_name in attribute_plan:
+        value = getattr(element, member_name)
+        if value:
+          attributes.append((attribute_qname, value))
+      if element._other_attributes:
+        attrib = dict(attributes)
+        attrib.update(element._other_attributes)
+        attributes = sorted(attrib.iteritems())
+      prefixed_attributes = []
+      for attribute_qname, value in attributes:
+        namespace, attribute_name = _prefixed_qname(attribute_qname,
+                                                    self.prefixes)
+        if namespace is not None:
+          self.namespaces.add(namespace)
+        prefixed_attributes.append(' %s="%s"' % (
+            attribute_name, _escape_attribute(self._str(value))))
+
+      # The start tag of the root, which is the first thing written, is
+      # begun by close, once its namespaces are known.
+      if self.root is None and not (self.parts or self.pending or
+                                    self.chunks):
+        self.root = name
+      else:
+        write('<' + name)
+      if prefixed_attributes:
+        write(''.join(prefixed_attributes))
+
+    text = element.text
+    children = False
+    for member_name, repeating in element_plan:
+      member = getattr(element, member_name)
+      if member:
+        if not children:
+          children = True
+          if name is not None:
+            write('>')
+          if text:
+            write(_escape_text(self._str(text)))
+        if repeating:
+          for child in member:
+            self.write_element(child)
+        else:
+          self.write_element(member)
+    for child in element._other_elements:
+      if not children:
+        children = True
+        if name is not None:
+          write('>')
+        if text:
+          write(_escape_text(self._str(text)))
+      self.write_element(child)
+
+    if name is None:
+      if text and not children:
+        write(_escape_text(self._str(text)))
+    elif children:
+      write('</%s>' % name)
+    elif text:
+      write('>%s</%s>' % (_escape_text(self._str(text)), name))
+    else:
+      write(' />')
+
+    if len(self.parts) > 512:
+      self._flush()
+
+
 def _get_qname(element, version):
   if isinstance(element._qname, tuple):
     if version <= len(element._qname):
@@ -451,6 +987,48 @@ def _get_qname(element, version):
     return element._qname
 
 
+# Cache of the (namespace, tag) pairs of the qnames seen so far, see
+# _split_qname.
+_split_qnames = {}
+
+
+def _split_qname(qname):
+  """Splits a qname into its XML namespace and local tag.
+
+  The result is cached, so each distinct qname is usually only split once per
+  process, and its parts are interned, so that comparing them is cheap. The
+  cache is cleared once it holds MAX_CACHED_QNAMES qnames.
+
+  Args:
+    qname: string in the form '{xml_namespace}localtag' or 'tag' if there is
+           no namespace, or None.
+
+  Returns:
+    A (namespace, tag) tuple. The namespace is None if the qname has none.
+  """
+  try:
+    return _split_qnames[qname]
+  except KeyError:
+    pass
+  if qname is None:
+    return (None, None)
+  if qname.startswith('{'):
+    end = qname.index('}')
+    split = (_intern(qname[1:end]), _intern(qname[end + 1:]))
+  else:
+    split = (None, _intern(qname))
+  if len(_split_qnames) >= MAX_CACHED_QNAMES:
+    _split_qnames.clear()
+  _split_qnames[qname] = split
+  return split
+
+
+def _intern(string):
+  if isinstance(string, str):
+    return intern(string)
+  return string
+
+
 def _qname_matches(tag, namespace, qname):
   """Logic determines if a QName matches the desired local tag and namespace.
 
@@ -469,16 +1047,7 @@ def _qname_matches(tag, namespace, qname):
     namespace.
   """
   # If there is no expected namespace or tag, then everything will match.
-  if qname is None:
-    member_tag = None
-    member_namespace = None
-  else:
-    if qname.startswith('{'):
-      member_namespace = qname[1:qname.index('}')]
-      member_tag = qname[qname.index('}') + 1:]
-    else:
-      member_namespace = None
-      member_tag = qname
+  member_namespace, member_tag = _split_qname(qname)
   return ((tag is None and namespace is None)
       # If there is a tag, but no namespace, see if the local tag matches.
       or (namespace is None and member_tag == tag)
@@ -526,6 +1095,49 @@ xml_element_from_string = parse
 XmlElementFromString = xml_element_from_string
 
 
+def iterparse_entries(source, entry_class, version=1):
+  """Parses the entries of a feed one at a time, as they are read.
+
+  Unlike parse, this does not build a tree of the whole document before
+  converting it. Each entry is converted as soon as its end tag is read, and
+  its elements are then cleared, so that only one entry is held in memory at
+  a time. The XML itself is only read from source as it is needed, so for a
+  response which has not been read yet (see atom.http_core.StreamResponse)
+  it is not held in memory either. Elements of the feed itself, other than
+  its entries, are ignored.
+
+  Args:
+    source: str or an object with a read method, such as an HTTP response,
+        containing the XML of the feed.
+    entry_class: XmlElement subclass The class of the feed's entries.
+    version: int (optional) The version of the schema which should be used
+        when converting the XML into objects. The default is 1.
+
+  Yields:
+    An instance of entry_class for each entry in the feed, in order.
+  """
+  if isinstance(source, unicode):
+    source = source.encode(STRING_ENCODING)
+  if isinstance(source, str):
+    source = StringIO.StringIO(source)
+  entry_qname = _get_qname(entry_class, version)
+  feed = None
+  depth = 0
+  for event, element in ElementTree.iterparse(source, ('start', 'end')):
+    if event == 'start':
+      if feed is None:
+        feed = element
+      depth += 1
+      continue
+    depth -= 1
+    if depth == 1 and element.tag == entry_qname:
+      yield _xml_element_from_tree(element, entry_class, version)
+      feed.clear()
+
+
+IterparseEntries = iterparse_entries
+
+
 def _xml_element_from_tree(tree, target_class, version=1):
   if target_class._qname is None:
     instance = target_class()
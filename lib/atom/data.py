@@ -71,6 +71,7 @@ class Contributor(Person):
 
 class Link(atom.core.XmlElement):
   """The atom:link element."""
+  _compact = True
   _qname = ATOM_TEMPLATE % 'link'
   href = 'href'
   rel = 'rel'
@@ -123,6 +124,7 @@ class Content(Text):
 
 class Category(atom.core.XmlElement):
   """The atom:category element."""
+  _compact = True
   _qname = ATOM_TEMPLATE % 'category'
   term = 'term'
   scheme = 'scheme'
@@ -131,6 +133,7 @@ class Category(atom.core.XmlElement):
 
 class Id(atom.core.XmlElement):
   """The atom:id element."""
+  _compact = True
   _qname = ATOM_TEMPLATE % 'id'
 
 
@@ -165,6 +168,7 @@ class Date(atom.core.XmlElement):
 
 class Updated(Date):
   """The atom:updated element."""
+  _compact = True
   _qname = ATOM_TEMPLATE % 'updated'
 
 
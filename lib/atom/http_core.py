@@ -23,7 +23,10 @@ __author__ = 'j.s@google.com (Jeff Scudder)'
 
 
 import os
+import socket
 import StringIO
+import threading
+import time
 import urlparse
 import urllib
 import httplib
@@ -74,6 +77,28 @@ def get_headers(http_response):
     return headers
 
 
+class ChunkedBody(object):
+  """A request body made of strings which are sent one after the other.
+
+  Unlike a file-like object, the body can be sent again, so requests with it
+  can be retried or redirected.
+  """
+
+  def __init__(self, chunks):
+    """
+    Args:
+      chunks: list of strs which together make up the body.
+    """
+    self.chunks = chunks
+    self.size = sum(len(chunk) for chunk in chunks)
+
+  def __iter__(self):
+    return iter(self.chunks)
+
+  def __str__(self):
+    return ''.join(self.chunks)
+
+
 class HttpRequest(object):
   """Contains all of the parameters for an HTTP 1.1 request.
 
@@ -83,6 +108,9 @@ class HttpRequest(object):
   """
   method = None
   uri = None
+  # Whether the response may be returned before its body has been read, see
+  # StreamResponse.
+  stream_response = False
 
   def __init__(self, uri=None, method=None, headers=None):
     """Construct an HTTP request.
@@ -110,13 +138,16 @@ class HttpRequest(object):
     in RFC 1341.
 
     Args:
-      data: str or a file-like object containing a part of the request body.
+      data: str, ChunkedBody or a file-like object containing a part of the
+            request body.
       mime_type: str The MIME type describing the data
       size: int Required if the data is a file like object. If the data is a
             string, the size is calculated so this parameter is ignored.
     """
     if isinstance(data, str):
       size = len(data)
+    elif isinstance(data, ChunkedBody):
+      size = data.size
     if size is None:
       # TODO: support chunked transfer if some of the body is of unknown size.
       raise UnknownSize('Each part of the body must have a known size.')
@@ -196,6 +227,7 @@ class HttpRequest(object):
     new_request = HttpRequest(uri=copied_uri, method=self.method,
                               headers=self.headers.copy())
     new_request._body_parts = self._body_parts[:]
+    new_request.stream_response = self.stream_response
     return new_request
 
   def _dump(self):
@@ -462,7 +494,21 @@ class HttpClient(object):
       uri = Uri.parse_uri(uri)
 
     connection = self._get_connection(uri, headers=headers)
+    return self._send_request(connection, method, uri, headers, body_parts)
 
+  def _send_request(self, connection, method, uri, headers=None,
+                    body_parts=None):
+    """Sends an HTTP request over the connection and returns its response.
+
+    Args:
+      connection: The httplib connection to send the request over.
+      method: str example: 'GET', 'POST', 'PUT', 'DELETE', etc.
+      uri: atom.http_core.Uri
+      headers: dict of strings mapping to strings which will be sent as HTTP
+               headers in the request.
+      body_parts: list of strings, objects with a read method, or objects
+                  which can be converted to strings using str.
+    """
     if self.debug:
       connection.debuglevel = 1
 
@@ -514,6 +560,10 @@ def _send_data_part(data, connection):
       if binarydata == '': break
       connection.send(binarydata)
     return
+  elif isinstance(data, ChunkedBody):
+    for chunk in data:
+      connection.send(chunk)
+    return
   else:
     # The data object was not a file.
     # Try to convert to a string and send the data.
@@ -585,6 +635,204 @@ class ProxiedHttpClient(HttpClient):
     return None
 
 
+class _BufferedResponse(HttpResponse):
+  """An HttpResponse whose body has been read completely into memory.
+
+  Header names are looked up case insensitively, as in httplib.
+  """
+
+  def __init__(self, response):
+    HttpResponse.__init__(self, status=response.status,
+                          reason=response.reason,
+                          headers=dict(response.getheaders()),
+                          body=response.read())
+
+  def getheader(self, name, default=None):
+    return self._headers.get(name.lower(), default)
+
+  def getheaders(self):
+    return self._headers.items()
+
+
+class _StreamedResponse(object):
+  """A response whose body is read from its connection as it is used.
+
+  Once the body has been read to the end, release is called with True so
+  that the connection can be used again. If reading fails, it is called with
+  False so that the connection is closed.
+  """
+
+  def __init__(self, response, release):
+    self._response = response
+    self._release = release
+    self.status = response.status
+    self.reason = response.reason
+
+  def getheader(self, name, default=None):
+    return self._response.getheader(name, default)
+
+  def getheaders(self):
+    return self._response.getheaders()
+
+  def read(self, amt=None):
+    if self._release is None:
+      return ''
+    try:
+      if amt:
+        data = self._response.read(amt)
+      else:
+        data = self._response.read()
+    except Exception:
+      release, self._release = self._release, None
+      release(False)
+      raise
+    if not amt or not data:
+      release, self._release = self._release, None
+      release(True)
+    return data
+
+
+class StreamResponse(object):
+  """Asks for the response to a request to be returned before it is read.
+
+  Pass an instance as an extra argument of a client request whose converter
+  reads the response body a part at a time, for example
+  client.get_feed(uri, converter=convert, stream=StreamResponse()), so that
+  PooledHttpClient does not read the whole body into memory first. The
+  connection of the response is only put back in the pool once the body has
+  been read to the end; if it never is, the connection is closed when the
+  response is garbage collected.
+  """
+
+  def modify_request(self, http_request):
+    http_request.stream_response = True
+
+  ModifyRequest = modify_request
+
+
+# Methods whose requests may safely be sent again after an error, since
+# repeating them has the same effect as sending them once.
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'PUT', 'DELETE')
+
+
+class PooledHttpClient(ProxiedHttpClient):
+  """Performs HTTP requests over persistent, pooled connections.
+
+  Instead of opening a new connection, and for https doing a new TLS
+  handshake, for every request, connections are kept open between requests
+  in a pool for each (scheme, host, port). Every response is read completely
+  before it is returned so that its connection can be put back in the pool
+  right away, unless the request asked for it to be streamed, see
+  StreamResponse. A pooled connection which the server has closed while it was
+  idle is replaced by a new one, and the request is sent again if its method
+  is idempotent. Other requests, like POSTs, may already have reached the
+  server, so the error is raised instead.
+
+  Instances may be shared between threads; each request gets a connection
+  to itself.
+  """
+
+  def __init__(self, max_connections=4, idle_timeout=60):
+    """
+    Args:
+      max_connections: int The maximum number of idle connections kept open
+                       for each (scheme, host, port).
+      idle_timeout: int The number of seconds after which an idle connection
+                    is closed instead of being reused.
+    """
+    self.max_connections = max_connections
+    self.idle_timeout = idle_timeout
+    self._pools = {}
+    self._lock = threading.Lock()
+
+  def _pool_key(self, uri):
+    return (uri.scheme, uri.host, uri.port and int(uri.port))
+
+  def _check_out(self, uri, headers=None):
+    """Returns a connection for the uri, and whether it was pooled."""
+    now = time.time()
+    self._lock.acquire()
+    try:
+      pool = self._pools.get(self._pool_key(uri), [])
+      while pool:
+        connection, last_used = pool.pop()
+        if now - last_used < self.idle_timeout:
+          return connection, True
+        connection.close()
+    finally:
+      self._lock.release()
+    return self._get_connection(uri, headers=headers), False
+
+  def _check_in(self, uri, connection):
+    """Puts a connection back in the pool, or closes it if the pool is full."""
+    self._lock.acquire()
+    try:
+      pool = self._pools.setdefault(self._pool_key(uri), [])
+      if len(pool) < self.max_connections:
+        pool.append((connection, time.time()))
+        return
+    finally:
+      self._lock.release()
+    connection.close()
+
+  def close(self):
+    """Closes all of the idle connections."""
+    self._lock.acquire()
+    try:
+      pools, self._pools = self._pools, {}
+    finally:
+      self._lock.release()
+    for pool in pools.itervalues():
+      for connection, last_used in pool:
+        connection.close()
+
+  def _release(self, uri, connection, response, reusable):
+    """Puts the connection of a read response back in the pool if it can be
+    used again, and closes it otherwise."""
+    if reusable and not getattr(response, 'will_close', True):
+      self._check_in(uri, connection)
+    else:
+      connection.close()
+
+  def request(self, http_request):
+    return self._http_request(http_request.method, http_request.uri,
+                              http_request.headers, http_request._body_parts,
+                              stream=http_request.stream_response)
+
+  Request = request
+
+  def _http_request(self, method, uri, headers=None, body_parts=None,
+                    stream=False):
+    if isinstance(uri, (str, unicode)):
+      uri = Uri.parse_uri(uri)
+
+    connection, pooled = self._check_out(uri, headers=headers)
+    try:
+      response = self._send_request(connection, method, uri, headers,
+                                    body_parts)
+    except (httplib.HTTPException, socket.error):
+      connection.close()
+      if not pooled or method not in IDEMPOTENT_METHODS or \
+          [part for part in body_parts or [] if hasattr(part, 'read')]:
+        raise
+      # The server closed the connection while it was idle, so try again on
+      # a new one. Streamed bodies can not be sent again.
+      connection = self._get_connection(uri, headers=headers)
+      response = self._send_request(connection, method, uri, headers,
+                                    body_parts)
+
+    if stream:
+      return _StreamedResponse(response, lambda reusable: self._release(
+          uri, connection, response, reusable))
+    try:
+      buffered = _BufferedResponse(response)
+    except Exception:
+      connection.close()
+      raise
+    self._release(uri, connection, response, True)
+    return buffered
+
+
 def _get_proxy_auth():
   import base64
   proxy_username = os.environ.get('proxy-username')
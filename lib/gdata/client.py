@@ -771,8 +771,11 @@ class GDClient(atom.client.AtomPubClient):
           among others.
     """
     http_request = atom.http_core.HttpRequest()
+    # Batch feeds can be large, so send them a chunk at a time rather than
+    # joining them into one string.
     http_request.add_body_part(
-        feed.to_string(get_xml_version(self.api_version)),
+        atom.http_core.ChunkedBody(
+            feed.to_chunks(get_xml_version(self.api_version))),
         'application/atom+xml')
     if force:
       http_request.headers['If-Match'] = '*'
@@ -307,9 +307,9 @@ class ExtendedProperty(atom.core.XmlElement):
     # Erase any existing extension_elements, clears the child nodes from the
     # extendedProperty.
     if isinstance(blob, atom.core.XmlElement):
-      self._other_elements = [blob]
+      self.extension_elements = [blob]
     else:
-      self._other_elements = [atom.core.parse(str(blob))]
+      self.extension_elements = [atom.core.parse(str(blob))]
 
   SetXmlBlob = set_xml_blob
 
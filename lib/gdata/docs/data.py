@@ -600,6 +600,12 @@ class Changestamp(atom.core.XmlElement):
   value = 'value'
 
 
+class LargestChangestamp(atom.core.XmlElement):
+  """The DocList docs:largestChangestamp element."""
+  _qname = DOCUMENTS_TEMPLATE  % 'largestChangestamp'
+  value = 'value'
+
+
 class Change(Resource):
   """Change feed entry."""
   changestamp = Changestamp
@@ -682,3 +688,4 @@ class Metadata(gdata.data.GDEntry):
   features = [Feature]
   max_upload_sizes = [MaxUploadSize]
   additional_role_info = [AdditionalRoleInfo]
+  largest_changestamp = LargestChangestamp
@@ -34,6 +34,7 @@ import gdata.data
 
 GS_TEMPLATE = '{http://schemas.google.com/spreadsheets/2006}%s'
 GSX_NAMESPACE = 'http://schemas.google.com/spreadsheets/2006/extended'
+GSX_PREFIX = '{%s}' % GSX_NAMESPACE
 
 
 INSERT_MODE = 'insert'
@@ -66,6 +67,7 @@ class Cell(atom.core.XmlElement):
   A cell in the worksheet. The <gs:cell> element can appear only as a child
   of <atom:entry>.
   """
+  _compact = True
   _qname = GS_TEMPLATE % 'cell'
   col = 'col'
   input_value = 'inputValue'
@@ -244,6 +246,8 @@ class ListRow(atom.core.XmlElement):
   col_value = ListRow(text='something')
   col_value._qname = col_value._qname % 'mycolumnname'
   """
+  _compact = True
+  __slots__ = ('_qname',)
   _qname = '{http://schemas.google.com/spreadsheets/2006/extended}%s'
 
 
@@ -255,6 +259,33 @@ class ListEntry(gdata.data.GDEntry):
   See also the explanation of column names in the ListFeed class.
   """
 
+  # Lazily built index of this row's gsx elements, see _get_column_index.
+  _column_index = None
+
+  def _get_column_index(self):
+    """Returns a dict mapping the column names in this row to their elements.
+
+    The index is built the first time a value is read, so that reading many
+    values from a row scans its elements only once instead of once per read.
+    set_value keeps it up to date, and it is forgotten whenever
+    _other_elements is changed through _writable_other_elements or
+    extension_elements.
+    """
+    index = self._column_index
+    if index is None:
+      index = {}
+      for element in self._other_elements:
+        qname = element._qname
+        if isinstance(qname, (str, unicode)) and qname.startswith(GSX_PREFIX):
+          index.setdefault(qname[len(GSX_PREFIX):], element)
+      self._column_index = index
+    return index
+
+  def _other_elements_changed(self):
+    super(ListEntry, self)._other_elements_changed()
+    if self._column_index is not None:
+      self._column_index = None
+
   def get_value(self, column_name):
     """Returns the displayed text for the desired column in this row.
 
@@ -264,10 +295,10 @@ class ListEntry(gdata.data.GDEntry):
     If a column is not present in this spreadsheet, or there is no value
     for a column in this row, this method will return None.
     """
-    values = self.get_elements(column_name, GSX_NAMESPACE)
-    if len(values) == 0:
+    element = self._get_column_index().get(column_name)
+    if element is None:
       return None
-    return values[0].text
+    return element.text
 
   def set_value(self, column_name, value):
     """Changes the value of cell in this row under the desired column name.
@@ -282,22 +313,24 @@ class ListEntry(gdata.data.GDEntry):
     spaces, uppercase letters, etc.
     """
     # Try to find the column in this row to change an existing value.
-    values = self.get_elements(column_name, GSX_NAMESPACE)
-    if len(values) > 0:
-      values[0].text = value
+    index = self._get_column_index()
+    element = index.get(column_name)
+    if element is not None:
+      element.text = value
     else:
       # There is no value in this row for the desired column, so add a new
       # gsx:column_name element.
       new_value = ListRow(text=value)
       new_value._qname = new_value._qname % (column_name,)
-      self._other_elements.append(new_value)
+      self._writable_other_elements().append(new_value)
+      index[column_name] = new_value
+      self._column_index = index
 
   def to_dict(self):
     """Converts this row to a mapping of column names to their values."""
     result = {}
-    values = self.get_elements(namespace=GSX_NAMESPACE)
-    for item in values:
-      result[item._get_tag()] = item.text
+    for column_name, element in self._get_column_index().iteritems():
+      result[column_name] = element.text
     return result
 
   def from_dict(self, values):
@@ -335,6 +368,7 @@ class ListsFeed(gdata.data.GDFeed):
 
 class CellEntry(gdata.data.BatchEntry):
   """An Atom entry representing a single cell in a worksheet."""
+  _compact = True
   cell = Cell
 
 
@@ -0,0 +1,99 @@
+# coding=utf-8
+import threading
+import time
+from gdata.client import NotModified
+
+import logging
+
+# Number of seconds a cached resource is used before being revalidated
+DEFAULT_TTL = 300
+
+
+class ResourceCache(object):
+    """
+        A cache of GData entries and feeds. A cached value is returned as is
+        until it is ttl seconds old. After that, it is revalidated with a
+        conditional request using its ETag, and is only downloaded again if
+        it has changed. Keeps count of hits, misses and revalidations.
+    """
+
+    def __init__(self, ttl=DEFAULT_TTL):
+        self.ttl = ttl
+        self.__values__ = {}
+        self.__lock__ = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+
+    def get(self, key, fetch):
+        """
+            Returns the value cached under the provided key, using the provided
+            fetch function to retrieve it if it is not cached, or to revalidate
+            it if it is stale.
+
+            Input:  key - a hashable key identifying the resource
+                    fetch - a function that takes an ETag and returns the
+                            resource. If the ETag is None, the resource must be
+                            fetched unconditionally. Otherwise, it must raise
+                            gdata.client.NotModified if the resource still has
+                            that ETag.
+            Output: the cached or fetched resource
+        """
+        now = time.time()
+        with self.__lock__:
+            cached = self.__values__.get(key)
+        if cached:
+            value, fetched = cached
+            if now - fetched < self.ttl:
+                with self.__lock__:
+                    self.hits += 1
+                return value
+
+            etag = getattr(value, 'etag', None)
+            if etag:
+                try:
+                    value = fetch(etag)
+                except NotModified:
+                    with self.__lock__:
+                        self.revalidations += 1
+                        self.__values__[key] = (value, now)
+                    return value
+                with self.__lock__:
+                    self.misses += 1
+                    self.__values__[key] = (value, now)
+                return value
+
+        value = fetch(None)
+        with self.__lock__:
+            self.misses += 1
+            self.__values__[key] = (value, now)
+        return value
+
+    def invalidate(self, key=None):
+        """
+            Removes the value cached under the provided key, or every cached
+            value if no key is provided.
+        """
+        with self.__lock__:
+            if key is None:
+                self.__values__.clear()
+            else:
+                self.__values__.pop(key, None)
+
+    def counters(self):
+        """
+            Returns a dict of the number of hits, misses and revalidations of
+            the cache.
+        """
+        with self.__lock__:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'revalidations': self.revalidations}
+
+    def logCounters(self, name='Resource cache'):
+        """
+            Logs the counters of the cache.
+        """
+        counters = self.counters()
+        logging.info('%s: %s hits, %s misses, %s revalidations' %
+                     (name, counters['hits'], counters['misses'],
+                      counters['revalidations']))
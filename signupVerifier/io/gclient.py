@@ -1,19 +1,41 @@
 # coding=utf-8
+import copy
 import datetime as dt
-import re
+import urllib
 from gdata.docs.client import DocsClient
+from gdata.data import BatchOperation, BatchId, BATCH_INSERT, BATCH_UPDATE,\
+    BATCH_DELETE
 from gdata.docs.data import Resource, AclEntry
-from gdata.spreadsheets.client import SpreadsheetsClient, WorksheetQuery,\
-    CellQuery
-from gdata.spreadsheets.data import ListEntry, BuildBatchCellsUpdate
+from gdata.spreadsheets.client import SpreadsheetsClient, CellQuery, \
+    ListQuery
+from gdata.client import get_xml_version, RequestError
+from gdata.spreadsheets.data import ListEntry, CellEntry, \
+    BuildBatchCellsUpdate
+from atom.core import iterparse_entries
+from atom.http_core import HttpRequest, PooledHttpClient, StreamResponse, \
+    Uri
 from ..settings import settings
-from ..models import Batch, BatchSpreadsheet
+from ..models import Batch, BatchSpreadsheet, Bounce, OptOut
+from ..models.utils import prefetchReferences, IN_FILTER_SIZE
 from ..processors.final_processor import getBatches
-from utils import tryXTimes
+from utils import tryXTimes, runConcurrently
+from cache import ResourceCache
+from sheet_rows import SheetRow, list_column_name, header_columns, \
+    rows_from_cells, sheet_row
+from person_rows import PersonRowNormalizer
+from ..validation import required_person_headers, meta_rules, validateDict,\
+    errorMessages
 
 import logging
 
-EMAIL_REGEX = r"[^@;]+@[^@]+\.[^@;]+"
+# Maximum number of cell updates sent in a single batch request
+CELLS_BATCH_SIZE = 1000
+
+# Number of rows at the top of a Raw sheet searched for its header row
+HEADER_SEARCH_ROWS = 10
+
+# Maximum number of folders listed at once when crawling a folder tree
+CRAWL_WORKERS = 4
 
 
 def spreadsheet_id(spreadsheet):
@@ -41,6 +63,56 @@ def worksheet_id(worksheet):
     assert wid
     return wid
 
+
+def entry_stream(client, entry_class):
+    """
+        Returns a converter for the requests of the provided GData client that
+        parses the entries of the response's feed one at a time, instead of
+        building the whole feed first. Requests using it should also pass
+        stream=StreamResponse(), so that the response is parsed as it is read
+        from the connection rather than after all of it has been read into
+        memory.
+    """
+    version = get_xml_version(client.api_version)
+    return lambda response: iterparse_entries(response, entry_class, version)
+
+
+def resource_updated(resource):
+    """
+        Returns the time that the GData Resource was last updated, as a naive
+        datetime in UTC.
+    """
+    return dt.datetime.strptime(resource.updated.text[:19],
+                                '%Y-%m-%dT%H:%M:%S')
+
+
+def resource_changestamp(resource):
+    """
+        Returns the changestamp of the GData Resource as an int, if it is a
+        Change from Google Drive's changes feed, or None otherwise.
+    """
+    changestamp = getattr(resource, 'changestamp', None)
+    if changestamp is None or changestamp.value is None:
+        return None
+    return int(changestamp.value)
+
+
+def untyped_resource_id(resource_id):
+    """
+        Returns the provided Google Drive resource ID without its type, so
+        that 'folder:abc' and 'abc' compare equal.
+    """
+    return resource_id.split(':')[-1]
+
+
+def parent_ids(resource):
+    """
+        Returns the resource IDs of the folders containing the GData Resource.
+    """
+    return [urllib.unquote(link.href.rsplit('/', 1)[-1])
+            for link in resource.InCollections()]
+
+
 meta_key_map = {
     'staff_name': 'staffname',
     'staff_email': 'staffemail',
@@ -59,6 +131,14 @@ meta_keys_model_only = [
     'bounced_persons'
 ]
 
+# Keys that only appear in the Person model, not in the ListRow
+person_keys_model_only = [
+    'source_batch',
+    'bounced',
+    'opted_out',
+    'superseded'
+]
+
 person_key_map = {
     'first_name': 'firstname',
     'last_name': 'lastname',
@@ -80,10 +160,20 @@ person_key_map = {
 
 
 class GClient(object):
-    def __init__(self):
+    def __init__(self, resource_cache=None):
+        """
+            Input:  resource_cache - an optional ResourceCache to share with
+                                     other GClients, such as those of other
+                                     threads. ResourceCaches are thread safe.
+                                     By default, the GClient has its own.
+        """
         self.__docsClient__ = None
         self.__spreadsheetsClient__ = None
-        self.__rawSheetIds__ = {}
+        self.__worksheetIndexes__ = {}
+        self.__resourceCache__ = resource_cache or ResourceCache()
+        # Shared by both clients, so that their connections are kept open
+        # between requests
+        self.__httpClient__ = PooledHttpClient()
 
     # For now, being lazy and using username/password.
     # Eventually, we should use Oauth.
@@ -91,7 +181,7 @@ class GClient(object):
     @property
     def docsClient(self):
         if self.__docsClient__ is None:
-            self.__docsClient__ = DocsClient()
+            self.__docsClient__ = DocsClient(http_client=self.__httpClient__)
             tryXTimes(lambda: self.__docsClient__.ClientLogin(
                 settings['app_username'],
                 settings['app_password'],
@@ -100,10 +190,21 @@ class GClient(object):
         assert self.__docsClient__
         return self.__docsClient__
 
+    def newDocsClient(self):
+        """
+            Returns a new DocsClient that uses the login and the pooled
+            connections of docsClient, without logging in again. GData clients
+            are not thread safe, so threads other than the one using this
+            GClient should each make requests through their own DocsClient.
+        """
+        return DocsClient(http_client=self.__httpClient__,
+                          auth_token=self.docsClient.auth_token)
+
     @property
     def spreadsheetsClient(self):
         if self.__spreadsheetsClient__ is None:
-            self.__spreadsheetsClient__ = SpreadsheetsClient()
+            self.__spreadsheetsClient__ = SpreadsheetsClient(
+                http_client=self.__httpClient__)
             tryXTimes(lambda: self.__spreadsheetsClient__.ClientLogin(
                 settings['app_username'],
                 settings['app_password'],
@@ -111,6 +212,14 @@ class GClient(object):
         assert self.__spreadsheetsClient__
         return self.__spreadsheetsClient__
 
+    @property
+    def resourceCache(self):
+        """
+            The cache of Resources and Worksheet feeds fetched by this client,
+            and by any other clients it is shared with.
+        """
+        return self.__resourceCache__
+
     #################################
     # dict <-> ListEntity converters
     #################################
@@ -166,8 +275,9 @@ class GClient(object):
         for i, forum in enumerate(d['forums']):
             d['forum%s' % (i+1)] = forum
         del d['forums']
-        if 'source_batch' in d:
-            del d['source_batch']
+        for person_key in person_keys_model_only:
+            if person_key in d:
+                del d[person_key]
 
         # Make sure that all attributes are strings and not None
         keys = d.keys()
@@ -184,9 +294,9 @@ class GClient(object):
             A general ListEntry -> dict converter. Does not make any changes to
             keys or data.
         """
-        if not isinstance(r, ListEntry):
-            raise TypeError('Row to Dict conversion requires a ListRow,'
-                            + 'received a %s' % type(r))
+        if not isinstance(r, (ListEntry, SheetRow)):
+            raise TypeError('Row to Dict conversion requires a ListRow or '
+                            'SheetRow, received a %s' % type(r))
 
         d = r.to_dict()
         return d
@@ -200,6 +310,11 @@ class GClient(object):
         """
         d = self.rowToDict(r)
 
+        # Validate the sheet
+        errors = validateDict(d, meta_rules)
+        if errors:
+            raise ValueError('; '.join(errorMessages(errors)))
+
         # Convert keys
         for dict_key, row_key in meta_key_map.iteritems():
             if row_key in d:
@@ -208,67 +323,118 @@ class GClient(object):
                 if isinstance(d[dict_key], basestring):
                     d[dict_key] = d[dict_key].strip()
 
-        # Validate the sheet
-        if not re.match(EMAIL_REGEX, d['staff_email']):
-            raise ValueError('Malformed email address')
-
         if 'event_date' in d and d['event_date'] is not None:
             d['event_date'] = dt.datetime.strptime(d['event_date'],
                                                    "%m/%d/%Y").date()
 
         return d
 
+    def sheetRow(self, r):
+        """
+            Returns the provided row as a SheetRow, converting ListEntries.
+        """
+        if not isinstance(r, (ListEntry, SheetRow)):
+            raise TypeError('Row to SheetRow conversion requires a ListRow or '
+                            'SheetRow, received a %s' % type(r))
+
+        return sheet_row(r)
+
     def personRowToDict(self, r):
         """
-            Converts a spreadsheet ListEntry to a dict. The ListEntry's
-            attributes will be used as the dict's keys.
+            Converts a spreadsheet ListEntry to a dict, with a
+            PersonRowNormalizer. Values which can not be cast are left as they
+            are; use invalidPersonRow to find them.
 
-            Input: r - a ListRow
+            Input: r - a ListRow or SheetRow
             Output: A dict containing the data of r
         """
-        d = self.rowToDict(r)
-
-        # Convert some keys
-        for dict_key, row_key in person_key_map.iteritems():
-            if row_key in d:
-                d[dict_key] = d[row_key]
-                del d[row_key]
-                if isinstance(d[dict_key], basestring):
-                    d[dict_key] = d[dict_key].strip()
+        row = self.sheetRow(r)
+        return self.personRowNormalizer(row.columns).convert(row)
 
-        # Casting
-        yes = ['yes', 'true']
-        if 'num_in_house' in d and d['num_in_house']:
-            d['num_in_house'] = int(d['num_in_house'])
-        if 'yrly_income' in d and d['yrly_income']:
-            d['yrly_income'] = int(d['yrly_income'])
-        if 'born_out_of_us' in d and d['born_out_of_us']:
-            d['born_out_of_us'] = d['born_out_of_us'].lower() in yes
-        if 'parents_born_out_of_us' in d and d['parents_born_out_of_us']:
-            d['parents_born_out_of_us'] = d['parents_born_out_of_us'].lower() \
-                in yes
-
-        # Set required values
-        if 'delivery_setting' in d and not d['delivery_setting']:
-            d['delivery_setting'] = 'email'
-        # Forum column/dict keys - XML does not support tags with just numeric
-        # names, and Google semi-randomly assigns XML names in these cases. So
-        # we have to make the forum column names strings in the spreadsheet.
-        # http://comments.gmane.org/gmane.org.google.api.docs/1306
-        forum_keys = [key for key in d.keys()
-                      if key.startswith('forum')]
-        forum_keys.sort()
-        d['forums'] = []
-        for i in forum_keys:
-            if d[i] is not None:
-                d['forums'].append(d[i])
-            del d[i]
+    def personRowNormalizer(self, columns):
+        """
+            Returns a PersonRowNormalizer for the SheetRows of a Raw sheet with
+            the provided columns, which converts and validates rows like
+            personRowToDict and invalidPersonRow in a single pass.
 
-        return d
+            Input:  columns - a dict mapping the sheet's column names to
+                              positions, as in SheetRow.columns
+            Output: A PersonRowNormalizer instance
+        """
+        return PersonRowNormalizer(columns, person_key_map)
 
     #####################################
     # Google Drive Interaction Functions
     #####################################
+    def getResourceById(self, resource_id):
+        """
+            Returns the Resource of the provided ID, from the resource cache
+            if it is fresh there. Stale Resources are revalidated with their
+            ETag rather than downloaded again.
+
+            Input:  resource_id - the ID of a Google Drive Resource
+            Output: A Resource instance. It may be shared with other callers,
+                    so it should not be modified.
+        """
+        def fetch(etag):
+            return tryXTimes(lambda: self.docsClient.GetResourceById(
+                resource_id, etag=etag))
+
+        return self.__resourceCache__.get(('resource', resource_id), fetch)
+
+    def getWorksheets(self, sid):
+        """
+            Returns the Worksheets feed of the spreadsheet of the provided ID,
+            from the resource cache if it is fresh there. Stale feeds are
+            revalidated with their ETag rather than downloaded again.
+
+            Input:  sid - the ID of a Google Spreadsheet
+            Output: A WorksheetsFeed instance. It may be shared with other
+                    callers, so it should not be modified.
+        """
+        def fetch(etag):
+            def get():
+                http_request = HttpRequest()
+                if etag:
+                    http_request.headers['If-None-Match'] = etag
+                return self.spreadsheetsClient.GetWorksheets(
+                    sid, http_request=http_request)
+            return tryXTimes(get)
+
+        return self.__resourceCache__.get(('worksheets', sid), fetch)
+
+    def worksheetIndex(self, spreadsheet):
+        """
+            Returns a dict mapping the titles of the worksheets in the provided
+            spreadsheet to lists of the Worksheet instances with that title.
+            The index is built from a single Worksheets feed and reused until
+            invalidateWorksheets is called for the spreadsheet.
+
+            Input:  spreadsheet - An instance of a Google Spreadsheet
+            Output: A dict of title -> list of Worksheet instances
+        """
+        sid = spreadsheet_id(spreadsheet)
+        if sid not in self.__worksheetIndexes__:
+            index = {}
+            for sheet in self.getWorksheets(sid).entry:
+                index.setdefault(sheet.title.text, []).append(sheet)
+            self.__worksheetIndexes__[sid] = index
+
+        return self.__worksheetIndexes__[sid]
+
+    def invalidateWorksheets(self, spreadsheet):
+        """
+            Forgets the worksheets known for the provided spreadsheet, so that
+            they are fetched again on the next lookup. Must be called after
+            worksheets are added to, removed from, renamed or resized in the
+            spreadsheet.
+
+            Input:  spreadsheet - An instance of a Google Spreadsheet
+        """
+        sid = spreadsheet_id(spreadsheet)
+        self.__worksheetIndexes__.pop(sid, None)
+        self.__resourceCache__.invalidate(('worksheets', sid))
+
     def getWorksheet(self, spreadsheet, title):
         """
             Returns a Worksheet instance for the worksheet in the provided
@@ -283,56 +449,65 @@ class GClient(object):
             Throws: IndexError if there is more than one worksheet of the
                     provided title.
         """
-        sid = spreadsheet_id(spreadsheet)
-        sheets = tryXTimes(lambda: self.spreadsheetsClient.GetWorksheets(sid,
-                           q=WorksheetQuery(title=title)
-        ).entry)
+        sheets = self.worksheetIndex(spreadsheet).get(title)
         if not sheets:
             return None
         if len(sheets) != 1:
             raise IndexError('Spreadsheet %s should have 1 %s sheet'
-                             % (sid, title))
+                             % (spreadsheet_id(spreadsheet), title))
         return sheets[0]
 
     def rawSheetId(self, spreadsheet):
         """
             Returns the id of the Raw Worksheet for the provided spreadsheet
         """
-        sid = spreadsheet_id(spreadsheet)
-        if not sid in self.__rawSheetIds__:
-            raw_sheet = self.getWorksheet(spreadsheet,
-                                          settings['raw_sheet_title'])
-            self.__rawSheetIds__[sid] = worksheet_id(raw_sheet)
-
-        assert self.__rawSheetIds__[sid]
-        return self.__rawSheetIds__[sid]
-
-    def getListFeed(self, spreadsheet, title):
+        raw_sheet = self.getWorksheet(spreadsheet, settings['raw_sheet_title'])
+        if raw_sheet is None:
+            raise LookupError('Spreadsheet %s does not have a %s sheet' %
+                              (spreadsheet_id(spreadsheet),
+                               settings['raw_sheet_title']))
+        return worksheet_id(raw_sheet)
+
+    def streamListFeed(self, spreadsheet, title):
         """
-            A general method for finding and retrieving the ListFeed for a
-            sheet of a specified name (title).
+            Requests the ListFeed for a sheet of a specified name (title),
+            and generates its entries one at a time as they are read from the
+            connection and parsed, so that neither the feed's XML nor its
+            entries are ever all held in memory. The request is not retried.
 
             Input:  spreadsheet - a Resource instance of a spreadsheet with
                                     a sheet of the specified name.
                     title - The specific sheet to look for
-            Output: A ListFeed of the specified sheet
+            Output: A generator of the ListEntries of the specified sheet
         """
         if not isinstance(spreadsheet, Resource) and \
                 spreadsheet.GetResourceType() != 'spreadsheet':
             raise TypeError('a Resource instance of type spreadsheet required')
 
         sid = spreadsheet_id(spreadsheet)
-        q = WorksheetQuery(title=title)
-        sheets = tryXTimes(lambda: self.spreadsheetsClient.GetWorksheets(sid,
-                           q=q).entry)
+        sheets = self.worksheetIndex(spreadsheet).get(title)
 
-        if len(sheets) == 0:
+        if not sheets:
             raise LookupError('Provided spreadsheet does not have a %s sheet' %
                               title)
 
         sheet_id = worksheet_id(sheets[0])
-        return tryXTimes(lambda: self.spreadsheetsClient.GetListFeed(sid,
-                         sheet_id).entry)
+        return self.spreadsheetsClient.GetListFeed(sid, sheet_id,
+            converter=entry_stream(self.spreadsheetsClient, ListEntry),
+            stream=StreamResponse())
+
+    def getListFeed(self, spreadsheet, title):
+        """
+            A general method for finding and retrieving the ListFeed for a
+            sheet of a specified name (title).
+
+            Input:  spreadsheet - a Resource instance of a spreadsheet with
+                                    a sheet of the specified name.
+                    title - The specific sheet to look for
+            Output: A list of the ListEntries of the specified sheet
+        """
+        return tryXTimes(lambda: list(self.streamListFeed(spreadsheet,
+                                                          title)))
 
     def getMetaListFeed(self, spreadsheet):
         """
@@ -362,6 +537,45 @@ class GClient(object):
         """
         return self.getListFeed(spreadsheet, settings['raw_sheet_title'])
 
+    def getRows(self, spreadsheet, title):
+        """
+            Reads the whole sheet of the provided name (title) through the
+            cells feed in a single request, and returns its rows as SheetRows.
+            SheetRows can be used in place of the ListEntries of getListFeed,
+            but are much cheaper to read values from.
+
+            Input:  spreadsheet - a Resource instance of a spreadsheet with
+                                    a sheet of the specified name.
+                    title - The specific sheet to read
+            Output: A list of SheetRows, one per row below the header row, up
+                    to the first blank row
+        """
+        sheet = self.getWorksheet(spreadsheet, title)
+        if sheet is None:
+            raise LookupError('Provided spreadsheet does not have a %s sheet' %
+                              title)
+
+        sid = spreadsheet_id(spreadsheet)
+        wsid = worksheet_id(sheet)
+
+        def read():
+            cells = self.spreadsheetsClient.GetCells(sid, wsid,
+                converter=entry_stream(self.spreadsheetsClient, CellEntry),
+                stream=StreamResponse())
+            return rows_from_cells((int(cell.cell.row), int(cell.cell.col),
+                                    cell.content.text) for cell in cells)
+        return tryXTimes(read)
+
+    def getRawRows(self, spreadsheet):
+        """
+            Reads the Raw sheet in the provided Spreadsheet as SheetRows.
+
+            Input: spreadsheet - a Resource instance of a spreadsheet with a
+                                 Raw sheet.
+            Output: A list of SheetRows of the Raw sheet
+        """
+        return self.getRows(spreadsheet, settings['raw_sheet_title'])
+
     def isFirstRawRowValid(self, spreadsheet):
         """
             Indicates weather the first row of the Raw sheet is a valid set of
@@ -431,6 +645,81 @@ class GClient(object):
         rsid = self.rawSheetId(spreadsheet)
         return self.deleteFirstRow(sid, rsid)
 
+    def findHeaderRow(self, gsid, wsid, max_rows=HEADER_SEARCH_ROWS):
+        """
+            Reads the first max_rows rows of the worksheet associated with gsid
+            and wsid in a single request, and finds the first of them that has
+            all of the required person headers.
+
+            Input:  gsid - ID of the Google Spreadsheet to search
+                    wsid - ID of the worksheet to search
+                    max_rows - the number of rows to search
+            Output: a tuple of the number of the header row, and a dict mapping
+                    the numbers of the non-empty rows read to dicts of column
+                    number -> cell value
+            Throws: LookupError if none of the rows read is a header row
+        """
+        cells = tryXTimes(lambda: self.spreadsheetsClient.GetCells(gsid, wsid,
+                          q=CellQuery(1, max_rows)).entry)
+        rows = {}
+        for cell in cells:
+            rows.setdefault(int(cell.cell.row), {})[int(cell.cell.col)] = \
+                cell.content.text or ''
+
+        for row_number in sorted(rows):
+            headers = set(list_column_name(value)
+                          for value in rows[row_number].itervalues())
+            if headers.issuperset(required_person_headers):
+                return row_number, rows
+
+        raise LookupError('No header row found in the first %s rows of '
+                          'worksheet %s' % (max_rows, wsid))
+
+    def fixRawHeaderRow(self, spreadsheet, max_rows=HEADER_SEARCH_ROWS):
+        """
+            Makes sure that the first row of the Raw sheet of the provided
+            spreadsheet is its header row, since sometimes meta headers are
+            placed above it. Any rows above the header row are removed.
+
+            Input:  spreadsheet - a Spreadsheet instance
+                    max_rows - the number of rows at the top of the Raw sheet
+                               to search for the header row
+            Output: the number of rows removed
+            Side Effect: the rows above the header row of the spreadsheet's
+                         Raw worksheet will be deleted on Google Drive
+            Throws: LookupError if none of the first max_rows rows is a header
+                    row
+        """
+        gsid = spreadsheet_id(spreadsheet)
+        rsid = self.rawSheetId(spreadsheet)
+        header_row, rows = self.findHeaderRow(gsid, rsid, max_rows)
+        if header_row == 1:
+            return 0
+
+        # 1.) Overwriting the first row with the header row. Blank rows above
+        # the header row get a placeholder, since the list feed stops at the
+        # first blank row and could not reach the rows below it.
+        header = rows[header_row]
+        update = BuildBatchCellsUpdate(gsid, rsid)
+        for col in set(header) | set(rows.get(1, {})):
+            update.AddSetCell(1, col, header.get(col, ''))
+        for row_number in range(2, header_row):
+            if row_number not in rows:
+                update.AddSetCell(row_number, 1, '-')
+        tryXTimes(lambda: self.spreadsheetsClient.batch(update, force=True))
+
+        # 2.) Deleting the rows between the new first row and the data, which
+        # are now the first entries of the list feed
+        removed = header_row - 1
+        entries = tryXTimes(lambda: self.spreadsheetsClient.GetListFeed(gsid,
+                            rsid, q=ListQuery(max_results=removed)).entry)
+        for entry in entries:
+            tryXTimes(lambda: self.spreadsheetsClient.Delete(entry))
+
+        logging.info('Removed %s rows above the header row of %s' %
+                     (removed, spreadsheet.title.text))
+        return removed
+
     def addRawSheetHeaders(self, new_spreadsheet, headers_to_add):
         """
             Alters the headers of the Raw worksheet via the Google Spreadsheets
@@ -474,6 +763,114 @@ class GClient(object):
 
         return True
 
+    def getHeaderColumns(self, gsid, wsid):
+        """
+            Returns a dict mapping the list feed names of the columns in the
+            header row of the worksheet associated with gsid and wsid to their
+            column numbers. As in the list feed, columns with duplicate names
+            have _n appended to their name.
+
+            Input:  gsid - ID of the Google Spreadsheet to read
+                    wsid - ID of the worksheet to read
+            Output: A dict of column name -> column number
+        """
+        header_cells = tryXTimes(lambda: self.spreadsheetsClient.GetCells(
+                                 gsid, wsid, q=CellQuery(1, 1)).entry)
+        return header_columns(dict((int(cell.cell.col), cell.content.text)
+                                   for cell in header_cells))
+
+    def writeRows(self, spreadsheet, worksheet, rows, start_row=2):
+        """
+            Writes the provided rows to the provided worksheet using batched
+            cell updates, so that CELLS_BATCH_SIZE cells are written per
+            request instead of one request being made per row. The worksheet
+            is grown first if it does not have enough rows.
+
+            Input:  spreadsheet - a Spreadsheet instance containing worksheet
+                    worksheet - the Worksheet instance to write rows to
+                    rows - a list of dicts, keyed by the list feed names of the
+                           worksheet's columns, as produced by rowToDict.
+                           Keys that match no column and None values are
+                           skipped.
+                    start_row - the row number to write the first row to
+            Output: the number of cells written
+            Side Effect: the rows of the worksheet on Google Drive starting at
+                         start_row are overwritten with the provided rows
+        """
+        gsid = spreadsheet_id(spreadsheet)
+        wsid = worksheet_id(worksheet)
+        columns = self.getHeaderColumns(gsid, wsid)
+
+        last_row = start_row + len(rows) - 1
+        if worksheet.row_count and int(worksheet.row_count.text) < last_row:
+            # The worksheet may be shared through worksheetIndex and the
+            # resource cache, so a copy of it is resized rather than it
+            resized = copy.deepcopy(worksheet)
+            resized.row_count.text = str(last_row)
+            tryXTimes(lambda: self.spreadsheetsClient.update(resized,
+                      force=True))
+            self.invalidateWorksheets(spreadsheet)
+
+        def send(update):
+            results = tryXTimes(lambda: self.spreadsheetsClient.batch(update,
+                                force=True))
+            for entry in results.entry:
+                if entry.batch_status and entry.batch_status.code != '200':
+                    logging.error('Failed to write cell %s: %s' %
+                                  (entry.id.text, entry.batch_status.reason))
+
+        update = BuildBatchCellsUpdate(gsid, wsid)
+        written = 0
+        unknown_keys = set()
+        for i, row in enumerate(rows):
+            for key, value in row.iteritems():
+                if value is None:
+                    continue
+                if key not in columns:
+                    unknown_keys.add(key)
+                    continue
+                update.AddSetCell(start_row + i, columns[key], value)
+                written += 1
+                if len(update.entry) >= CELLS_BATCH_SIZE:
+                    send(update)
+                    update = BuildBatchCellsUpdate(gsid, wsid)
+        if update.entry:
+            send(update)
+
+        if unknown_keys:
+            logging.warning('Worksheet %s has no columns for %s' %
+                            (wsid, ', '.join(sorted(unknown_keys))))
+
+        return written
+
+    def writeInvalidPersonRows(self, spreadsheet, worksheet, invalid_rows):
+        """
+            Writes all of the invalid person rows of a batch, along with their
+            validation errors, to the provided validation errors worksheet in
+            as few requests as possible.
+
+            Input:  spreadsheet - a Spreadsheet instance, as returned by
+                                  createValidationErrorsSpreadsheet
+                    worksheet - the Raw Worksheet instance of spreadsheet
+                    invalid_rows - a list of (row, errors) tuples, where row is
+                                   a ListEntry or dict of a person row and
+                                   errors is a list of validation errors for
+                                   the row, as returned by invalidPersonRow.
+            Output: the number of cells written
+            Side Effect: the invalid rows are written to the worksheet on
+                         Google Drive, with their errors in the Errors column.
+        """
+        rows = []
+        for row, errors in invalid_rows:
+            if isinstance(row, (ListEntry, SheetRow)):
+                row = self.rowToDict(row)
+            else:
+                row = dict(row)
+            row['errors'] = '; '.join(errors)
+            rows.append(row)
+
+        return self.writeRows(spreadsheet, worksheet, rows)
+
     def cloneSpreadsheetForFailure(self, ogsid, batch_id,
                                    suffix=None, headers_to_add=[]):
         """
@@ -497,15 +894,13 @@ class GClient(object):
         """
 
         # Get original and base spreadsheets
-        original_spreadsheet = tryXTimes(
-            lambda: self.docsClient.GetResourceById(ogsid))
-        base_spreadsheet = tryXTimes(lambda: self.docsClient.GetResourceById(
-            settings['base_spreadsheet_id']))
+        original_spreadsheet = self.getResourceById(ogsid)
+        base_spreadsheet = self.getResourceById(
+            settings['base_spreadsheet_id'])
 
         # Get Failed Signups folder
-        failed_signups_folder = tryXTimes(
-            lambda: self.docsClient.GetResourceById(
-                settings['failed_signups_folder_id']))
+        failed_signups_folder = self.getResourceById(
+            settings['failed_signups_folder_id'])
 
         # Create a new Spreadsheet in Failed Signups folder
         new_spreadsheet_title = original_spreadsheet.title.text + suffix
@@ -539,9 +934,8 @@ class GClient(object):
         # Add the additional headers to the Raw sheet
         # Create the cloned Raw sheet
         self.addRawSheetHeaders(new_spreadsheet, headers_to_add)
-        nrsid = self.rawSheetId(new_spreadsheet)
-        new_raw_sheet = tryXTimes(lambda: self.spreadsheetsClient.GetWorksheet(
-            ngsid, nrsid))
+        new_raw_sheet = self.getWorksheet(new_spreadsheet,
+                                          settings['raw_sheet_title'])
         return (new_spreadsheet, new_raw_sheet)
 
     def createValidationErrorsSpreadsheet(self, batch):
@@ -612,26 +1006,26 @@ class GClient(object):
         headers_to_add = ['Occurred', 'Message', 'Person ID']
         (new_spreadsheet, new_raw_sheet) = self.cloneSpreadsheetForFailure(
             ogsid, batch_id, " - Bounced", headers_to_add)
-        ngsid = spreadsheet_id(new_spreadsheet)
-        nrsid = worksheet_id(new_raw_sheet)
 
-        # Get the Bounces for this batch and populate the cloned Raw sheet
-        #TODO see about making this a batch operation
-        nbslf = tryXTimes(lambda: self.spreadsheetsClient.GetListFeed(ngsid,
-                          nrsid).entry)
-        for i, bounce in enumerate(batch.bounces):
-            bounce_dict = bounce.person.asDict()
+        # Get the Bounces for this batch, along with all of their Persons at
+        # once, and populate the cloned Raw sheet in one batch
+        bounces = batch.bounces.fetch(limit=None)
+        persons = prefetchReferences(bounces, Bounce.person)
+        bounce_rows = []
+        for bounce, person in zip(bounces, persons):
+            if person is None:
+                logging.error('Bounce %s refers to a missing Person' %
+                              bounce.key())
+                continue
+            bounce_dict = person.asDict()
 
             # Adjust some keys, add additional key/values
-            bounce_dict['person_id'] = bounce.person.key()
+            bounce_dict['person_id'] = person.key()
             bounce_dict['occurred'] = bounce.occurred
             bounce_dict['message'] = bounce.message
 
-            bounce_row = self.personDictToRow(bounce_dict)
-            bounce_entry = nbslf[i]
-            bounce_entry.from_dict(bounce_row.to_dict())
-            tryXTimes(lambda: self.spreadsheetsClient.Update(bounce_entry,
-                      force=True))
+            bounce_rows.append(self.personDictToRow(bounce_dict).to_dict())
+        self.writeRows(new_spreadsheet, new_raw_sheet, bounce_rows)
 
         self.setPermissions(new_spreadsheet, [batch.staff_email])
 
@@ -666,26 +1060,26 @@ class GClient(object):
         headers_to_add = ['Occurred', 'Reason', 'Person ID']
         (new_spreadsheet, new_raw_sheet) = self.cloneSpreadsheetForFailure(
             ogsid, batch_id, " - OptOuts", headers_to_add)
-        ngsid = spreadsheet_id(new_spreadsheet)
-        nrsid = worksheet_id(new_raw_sheet)
 
-        # Get the Optouts for this batch and populate the cloned Raw sheet
-        #TODO see about making this a batch operation
-        nrslf = tryXTimes(lambda: self.spreadsheetsClient.GetListFeed(ngsid,
-                          nrsid).entry)
-        for i, optout in enumerate(batch.optouts):
-            optout_dict = optout.person.asDict()
+        # Get the Optouts for this batch, along with all of their Persons at
+        # once, and populate the cloned Raw sheet in one batch
+        optouts = batch.optouts.fetch(limit=None)
+        persons = prefetchReferences(optouts, OptOut.person)
+        optout_rows = []
+        for optout, person in zip(optouts, persons):
+            if person is None:
+                logging.error('OptOut %s refers to a missing Person' %
+                              optout.key())
+                continue
+            optout_dict = person.asDict()
 
             # Adjust some keys, add additional key/values
             optout_dict['occurred'] = optout.occurred
             optout_dict['reason'] = optout.reason
-            optout_dict['person_id'] = optout.person.key()
+            optout_dict['person_id'] = person.key()
 
-            optout_row = self.personDictToRow(optout_dict)
-            optout_entry = nrslf[i]
-            optout_entry.from_dict(optout_row.to_dict())
-            tryXTimes(lambda: self.spreadsheetsClient.Update(optout_entry,
-                      force=True))
+            optout_rows.append(self.personDictToRow(optout_dict).to_dict())
+        self.writeRows(new_spreadsheet, new_raw_sheet, optout_rows)
 
         self.setPermissions(new_spreadsheet, [batch.staff_email])
 
@@ -695,34 +1089,88 @@ class GClient(object):
         """
         Sets the persmissions of the provided resource so that only the app's
         username, the staff person, and a small group of others can view and
-        edit the resource.
+        edit the resource. All of the changes are made in a single ACL batch
+        request, and users who already are writers are left alone.
 
         Input: resource - the Resource instance to set permissions for
         Side Effects: The ACL of the provided resource will be changed so that
                       only the above mentioned group of users will be able to
                       view and edit the resource.
         """
+        writers = set(user.lower() for user in
+                      users_to_add + settings['all_access_users'])
+
         acl_feed = tryXTimes(lambda: self.docsClient.GetResourceAcl(
             resource).entry)
+        changes = []
         for acl in acl_feed:
+            scope = (acl.scope.value or '').lower()
             if acl.role.value == 'owner' or \
-                    acl.scope.value == settings['app_username']:
+                    scope == settings['app_username'].lower():
                 continue
-            tryXTimes(lambda: self.docsClient.DeleteAclEntry(acl))
+            if scope in writers:
+                writers.discard(scope)
+                if acl.role.value == 'writer':
+                    continue
+                acl.role.value = 'writer'
+                acl.batch_operation = BatchOperation(type=BATCH_UPDATE)
+            else:
+                acl.batch_operation = BatchOperation(type=BATCH_DELETE)
+            changes.append(acl)
 
-        users_to_add.extend(settings['all_access_users'])
-        for user in set(users_to_add):
+        for user in writers:
             new_acl = AclEntry.GetInstance(role='writer', scope_type='user',
                                            scope_value=user)
-            tryXTimes(lambda: self.docsClient.AddAclEntry(resource, new_acl,
-                      send_notifications=False))
+            new_acl.batch_operation = BatchOperation(type=BATCH_INSERT)
+            changes.append(new_acl)
+
+        if not changes:
+            return
+
+        for i, acl in enumerate(changes):
+            acl.batch_id = BatchId(text=str(i))
+        no_emails = Uri(query={'send-notification-emails': 'false'})
+        results = tryXTimes(lambda: self.docsClient.batch_process_acl_entries(
+                            resource, changes, query=no_emails))
+        for entry in results.entry:
+            if entry.batch_status and \
+                    entry.batch_status.code not in ('200', '201'):
+                acl = changes[int(entry.batch_id.text)]
+                logging.error('Failed to %s ACL entry for %s: %s' %
+                              (acl.batch_operation.type, acl.scope.value,
+                               entry.batch_status.reason))
+
+    def folderContents(self, folder, query=None, client=None):
+        """
+            Returns every Resource in the provided folder, following the next
+            links of the folder's feed so that folders with more than one page
+            of contents are listed completely.
+
+            Input:  folder - a Resource instance representing a folder
+                    query - an optional Query instance used to search for
+                            resources with specific attributes
+                    client - an optional DocsClient to list the folder with,
+                             instead of docsClient
+            Output: a list of Resource instances
+        """
+        client = client or self.docsClient
+        contents = tryXTimes(lambda: client.GetResources(
+                             uri=folder.content.src, q=query))
+        entries = list(contents.entry)
+        while contents.find_next_link():
+            contents = tryXTimes(lambda: client.GetNext(contents))
+            entries.extend(contents.entry)
 
-    def spreadsheets(self, folder, query=None):
+        return entries
+
+    def spreadsheets(self, folder, query=None, modified_since=None,
+                     workers=CRAWL_WORKERS):
         """
         Generates a list of Google Spreadsheets based on the Resource
         instance provided, which is assumed to be a folder. If the provided
         folder contains other folders, they will be recursively searched
-        for spreadsheets and other folders, breadth first.
+        for spreadsheets and other folders, breadth first. The folders at each
+        depth are listed concurrently.
 
         Returned spreadsheets will be Resource instances.
 
@@ -730,6 +1178,12 @@ class GClient(object):
                          search on Drive.
                 query - a Query instance that is used to search for
                         spreadsheets with specific attributes.
+                modified_since - an optional datetime (UTC). If provided, only
+                                 spreadsheets updated at or after it are
+                                 returned. Folders are always listed, since
+                                 their updated time does not change when
+                                 something inside them does.
+                workers - the maximum number of folders to list at once
         Output: a list of Resource instances that represent spreadsheets
                 contained in the provided folder or its subfolders.
         """
@@ -737,21 +1191,120 @@ class GClient(object):
                 folder.GetResourceType() != 'folder':
             raise TypeError('a Resource instance of type folder required')
 
-        folders = []
+        # Each folder is listed with its own DocsClient, since the listing
+        # threads may only share the login and the connection pool, so the
+        # login is done before they start
+        assert self.docsClient
+
+        folders = [folder]
+        depth_query = query
+        while folders:
+            contents = runConcurrently(
+                lambda f: self.folderContents(f, depth_query,
+                                              self.newDocsClient()),
+                folders, workers)
+            folders = []
+            depth_query = None
+            for entries in contents:
+                for entry in entries:
+                    entry_id = entry.resource_id.text.replace('spreadsheet:',
+                                                              '')
+                    if entry.GetResourceType() == 'folder':
+                        folders.append(entry)
+                    elif entry.GetResourceType() == 'spreadsheet' and \
+                            entry_id != settings['base_spreadsheet_id'] and \
+                            (modified_since is None or
+                             resource_updated(entry) >= modified_since):
+                        yield entry
+
+    def largestChangestamp(self):
+        """
+            Returns the changestamp of the latest change to the app user's
+            Google Drive, from which changedSpreadsheets can look for later
+            changes.
 
-        contents = tryXTimes(lambda: self.docsClient.GetResources(
-                             uri=folder.content.src, q=query))
-        for entry in contents.entry:
-            entry_id = entry.resource_id.text.replace('spreadsheet:', '')
-            if entry.GetResourceType() == 'folder':
-                folders.append(entry)
-            elif entry.GetResourceType() == 'spreadsheet' and \
-                    entry_id != settings['base_spreadsheet_id']:
-                yield entry
-
-        for folder in folders:
-            for spreadsheet in self.spreadsheets(folder):
-                yield spreadsheet
+            Output: an int changestamp
+        """
+        metadata = tryXTimes(lambda: self.docsClient.GetMetadata())
+        return int(metadata.largest_changestamp.value)
+
+    def isInFolder(self, resource, folder_id, known=None):
+        """
+            Indicates whether the provided Resource is in the folder of the
+            provided ID, or in one of its subfolders, by looking up the folders
+            containing it.
+
+            Input:  resource - a Resource instance
+                    folder_id - the resource ID of a folder
+                    known - an optional dict of the folder IDs already looked
+                            up -> whether they are in the folder, which is
+                            added to, so that callers checking many Resources
+                            look up each folder once
+            Output: True if the resource is in the folder, False otherwise
+        """
+        folder_id = untyped_resource_id(folder_id)
+        if known is None:
+            known = {}
+        unknown = []
+        for parent_id in parent_ids(resource):
+            untyped_id = untyped_resource_id(parent_id)
+            if untyped_id == folder_id or known.get(untyped_id):
+                return True
+            if untyped_id not in known:
+                unknown.append((untyped_id, parent_id))
+
+        for untyped_id, parent_id in unknown:
+            # Marked as not in the folder first, in case folders contain
+            # each other
+            known[untyped_id] = False
+            try:
+                parent = self.getResourceById(parent_id)
+            except RequestError as e:
+                logging.warning('Could not look up folder %s: %s' %
+                                (parent_id, e))
+                continue
+            known[untyped_id] = self.isInFolder(parent, folder_id, known)
+            if known[untyped_id]:
+                return True
+        return False
+
+    def changedSpreadsheets(self, folder, changestamp):
+        """
+        Finds the spreadsheets in the provided folder or its subfolders that
+        changed after the provided changestamp, from Google Drive's changes
+        feed, so that the folder tree does not need to be listed. Spreadsheets
+        moved into the folder are changed by the move, so they are found even
+        if they were not edited.
+
+        Input:  folder - a Resource instance representing a folder
+                changestamp - the int changestamp after which to look for
+                              changes, as returned by largestChangestamp or a
+                              previous call
+        Output: a tuple of a list of Change instances, which are Resources, of
+                the changed spreadsheets and the largest changestamp seen,
+                which is the provided one if nothing changed
+        """
+        folder_id = folder.resource_id.text
+        changes = tryXTimes(lambda: self.docsClient.GetChanges(
+                            changestamp=str(changestamp + 1)))
+        entries = list(changes.entry)
+        while changes.find_next_link():
+            changes = tryXTimes(lambda: self.docsClient.GetNext(changes))
+            entries.extend(changes.entry)
+
+        known = {}
+        spreadsheets = []
+        for entry in entries:
+            changestamp = max(changestamp, resource_changestamp(entry))
+            if entry.removed is not None or entry.deleted is not None or \
+                    entry.GetResourceType() != 'spreadsheet':
+                continue
+            entry_id = untyped_resource_id(entry.resource_id.text)
+            if entry_id != settings['base_spreadsheet_id'] and \
+                    self.isInFolder(entry, folder_id, known):
+                spreadsheets.append(entry)
+
+        return spreadsheets, changestamp
 
     ####################
     # Validation Methods
@@ -762,36 +1315,14 @@ class GClient(object):
             Checks that the provided list row contains at least the minimum,
             well formed forms needed to represent a person.
 
-            Input: r - a ListRow
+            Input: r - a ListRow or SheetRow
             Output: A list of validation errors. If the list row is valid, the
                 list will be empty. Otherwise, it will contain one entry per
                 validation error.
         """
-        retval = []
-        # Validate email address
-        if not r.get_value('email') or not r.get_value('email').strip():
-            retval.append('Missing email address')
-        elif not re.match(EMAIL_REGEX, r.get_value('email')):
-            retval.append('Malformed email address')
-        # Validate first, last, and full names
-        if (not r.get_value('firstname') or
-                not r.get_value('firstname').strip()):
-            retval.append('Missing first name')
-        if (not r.get_value('lastname') or
-                not r.get_value('lastname').strip()):
-            retval.append('Missing last name')
-        if (r.get_value('fullname') is None or
-                not r.get_value('fullname').strip()):
-            retval.append('Missing full name')
-        # Validate at least one forum is selected
-        # Easiest to convert to dict and look for special keys
-        d = self.rowToDict(r)
-        forum_keys = [key for key in d.keys() if key.startswith('forum')
-                      and d[key] is not None]
-        if not forum_keys:
-            retval.append('No forums selected for the user')
-
-        return retval
+        row = self.sheetRow(r)
+        return errorMessages(
+            self.personRowNormalizer(row.columns).validate([row])[0])
 
     ####################################
     # Spreadsheet specific db functions
@@ -817,7 +1348,8 @@ class GClient(object):
 
         sid = spreadsheet_id(spreadsheet)
 
-        bs_record = BatchSpreadsheet(gsid=sid, batch=batch,
+        bs_record = BatchSpreadsheet(key_name=BatchSpreadsheet.keyName(sid),
+                                     gsid=sid, batch=batch,
                                      title=spreadsheet.title.text,
                                      url=spreadsheet.FindHtmlLink())
         bs_record.put()
@@ -827,26 +1359,38 @@ class GClient(object):
     def filterOutOldSpreadsheets(self, spreadsheets):
         """
         Returns a list of spreadsheets from the provided list that are not
-        already in the database.
+        already in the database. Only the provided spreadsheets are looked up,
+        so the cost does not grow with the number of spreadsheets processed
+        in the past.
 
         Input:  spreadsheets - list of Spreadsheet instances
         Output: a list of the difference between the input list and the list of
                 spreadsheets already in the database.
         """
-        q = BatchSpreadsheet.all()
-        all_batch_spreadsheets = q.run()
-
-        if all_batch_spreadsheets:
-            existing_spreadsheet_ids = [bs.gsid
-                                        for bs in all_batch_spreadsheets]
-
-            new_spreadsheets = [spreadsheet
-                                for spreadsheet in spreadsheets
-                                if spreadsheet_id(spreadsheet)
-                                not in existing_spreadsheet_ids]
-
-        else:
-            new_spreadsheets = spreadsheets
+        spreadsheets = list(spreadsheets)
+        sids = [spreadsheet_id(spreadsheet) for spreadsheet in spreadsheets]
+        if not sids:
+            return spreadsheets
+
+        # BatchSpreadsheets are keyed by gsid, so most can be found with a
+        # single batch get
+        existing_ids = set(
+            bs.gsid for bs in BatchSpreadsheet.get_by_key_name(
+                [BatchSpreadsheet.keyName(sid) for sid in sids])
+            if bs)
+
+        # BatchSpreadsheets saved before they were keyed by gsid have to be
+        # queried for. gsid cannot be projected since it is filtered on, but
+        # only the few legacy BatchSpreadsheets that match are returned.
+        unknown_ids = list(set(sids) - existing_ids)
+        for i in range(0, len(unknown_ids), IN_FILTER_SIZE):
+            q = BatchSpreadsheet.all()
+            q.filter('gsid IN', unknown_ids[i:i + IN_FILTER_SIZE])
+            existing_ids.update(bs.gsid for bs in q.run())
+
+        new_spreadsheets = [spreadsheet
+                            for spreadsheet, sid in zip(spreadsheets, sids)
+                            if sid not in existing_ids]
 
         return new_spreadsheets
 
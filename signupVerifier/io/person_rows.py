@@ -0,0 +1,143 @@
+# coding=utf-8
+from ..validation import isBlank, validateColumns, errorMessages, \
+    required_person_headers
+
+# Values of yes/no columns that mean yes
+yes_values = ['yes', 'true']
+
+
+def cast_yes(value):
+    """ Casts the value of a yes/no column to a boolean"""
+    return value.lower() in yes_values
+
+
+# Casts applied to the non-blank values of some person keys
+person_casts = {
+    'num_in_house': int,
+    'yrly_income': int,
+    'born_out_of_us': cast_yes,
+    'parents_born_out_of_us': cast_yes
+}
+
+
+class PersonRowNormalizer(object):
+    """
+        Converts the SheetRows of a Raw sheet into person dicts and validates
+        them. Everything that only depends on the sheet's header, like which
+        key each column becomes and which columns hold forums, is worked out
+        once when the normalizer is created, rather than once per row. Rows
+        are validated a whole column at a time, with the person_rules of the
+        validation module, and converted in a single pass each.
+
+        GClient.personRowToDict and GClient.invalidPersonRow convert and
+        validate single rows with a normalizer too.
+    """
+
+    def __init__(self, columns, key_map):
+        """
+            Input:  columns - a dict mapping the sheet's column names to
+                              positions, as in SheetRow.columns
+                    key_map - a dict mapping person keys to column names, as
+                              in person_key_map
+        """
+        self.columns = columns
+        row_keys = dict((row_key, dict_key)
+                        for dict_key, row_key in key_map.iteritems())
+
+        # (position, person key, whether to strip, cast) for each column
+        self.fields = []
+        forum_columns = []
+        for name, position in columns.iteritems():
+            if name.startswith('forum'):
+                forum_columns.append((name, position))
+                continue
+            key = row_keys.get(name, name)
+            self.fields.append((position, key, name in row_keys,
+                                person_casts.get(key)))
+        self.fields.sort()
+
+        # Forums are listed in order of their column names. XML does not
+        # support tags with just numeric names, and Google semi-randomly
+        # assigns XML names in these cases, so the forum columns are named
+        # with strings in the spreadsheet.
+        # http://comments.gmane.org/gmane.org.google.api.docs/1306
+        forum_columns.sort()
+        self.forums = [position for name, position in forum_columns]
+
+        self.required = [columns[name] for name in required_person_headers
+                         if name in columns]
+
+    def isBlank(self, row):
+        """
+            Indicates whether the provided row has none of the email, first
+            name, last name and full name columns filled in. Because of how the
+            Full Name column is a formula output that always includes an empty
+            space, a row must be checked this way to be sure that it is
+            actually data entered by a user.
+        """
+        values = row.values
+        for position in self.required:
+            if not isBlank(values[position]):
+                return False
+        return True
+
+    def convert(self, row):
+        """
+            Converts the provided row to a person dict. Values which can not be
+            cast are left as they are; validate the row to find them.
+
+            Input:  row - a SheetRow of the sheet this normalizer was created
+                          for
+            Output: A person dict
+        """
+        values = row.values
+        d = {}
+        for position, key, strip, cast in self.fields:
+            value = values[position]
+            if strip and value is not None:
+                value = value.strip()
+            if cast and value:
+                try:
+                    value = cast(value)
+                except ValueError:
+                    pass
+            d[key] = value
+
+        # Set required values
+        if 'delivery_setting' in d and not d['delivery_setting']:
+            d['delivery_setting'] = 'email'
+
+        d['forums'] = [values[position] for position in self.forums
+                       if values[position] is not None]
+        return d
+
+    def validate(self, rows):
+        """
+            Validates the provided rows a whole column at a time.
+
+            Input:  rows - a list of SheetRows of the sheet this normalizer
+                           was created for
+            Output: a list with one list of error codes per row. The list of a
+                    valid row is empty.
+        """
+        vectors = zip(*[row.values for row in rows])
+        if not vectors:
+            return [[] for row in rows]
+
+        return validateColumns(dict((name, vectors[position])
+                                    for name, position
+                                    in self.columns.iteritems()))
+
+    def normalize(self, rows):
+        """
+            Converts and validates the provided rows, skipping blank ones.
+
+            Input:  rows - a list of SheetRows of the sheet this normalizer
+                           was created for
+            Output: a list of (row, person dict, validation errors) tuples for
+                    the rows that are not blank. The list of validation errors
+                    of a valid row is empty.
+        """
+        rows = [row for row in rows if not self.isBlank(row)]
+        return [(row, self.convert(row), errorMessages(codes))
+                for row, codes in zip(rows, self.validate(rows))]
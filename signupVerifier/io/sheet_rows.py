@@ -0,0 +1,119 @@
+# coding=utf-8
+import re
+
+# Characters that the list feed removes from headers to name columns
+LIST_COLUMN_REMOVED = re.compile(r'[^a-z0-9\.\-]')
+
+
+def list_column_name(header):
+    """
+        Returns the name that the list feed uses for a column with the provided
+        header; lower case, with everything but letters, numbers, periods and
+        dashes removed.
+    """
+    return LIST_COLUMN_REMOVED.sub('', (header or '').lower())
+
+
+def header_columns(headers):
+    """
+        Returns a dict mapping the list feed names of the provided headers to
+        their positions. As in the list feed, headers with duplicate names have
+        _n appended to their name, and blank headers are left out.
+
+        Input:  headers - a dict of position -> header text
+        Output: A dict of column name -> position
+    """
+    columns = {}
+    for position in sorted(headers):
+        name = list_column_name(headers[position])
+        if not name:
+            continue
+        column_name = name
+        n = 2
+        while column_name in columns:
+            column_name = '%s_%s' % (name, n)
+            n += 1
+        columns[column_name] = position
+
+    return columns
+
+
+class SheetRow(object):
+    """
+        A row of a worksheet read through the cells feed. Offers the get_value
+        and to_dict methods of a list feed ListEntry, but looks values up by
+        position in a plain tuple instead of searching XML elements.
+    """
+    __slots__ = ('values', 'columns')
+
+    def __init__(self, values, columns):
+        """
+            Input:  values - a tuple of the displayed values of the row's
+                             cells, None for blank cells
+                    columns - a dict mapping column names to positions in
+                              values, shared by all rows of the worksheet
+        """
+        self.values = values
+        self.columns = columns
+
+    def get_value(self, column_name):
+        """
+            Returns the displayed value of the provided column in this row, or
+            None if the column does not exist or is blank in this row.
+        """
+        position = self.columns.get(column_name)
+        if position is None:
+            return None
+        return self.values[position]
+
+    def to_dict(self):
+        """ Returns this row as a dict of column name -> value"""
+        values = self.values
+        return dict((name, values[position])
+                    for name, position in self.columns.iteritems())
+
+
+def sheet_row(row):
+    """
+        Returns the provided list feed ListEntry as a SheetRow, so that it can
+        be converted like the rows read through the cells feed. SheetRows are
+        returned as they are.
+    """
+    if isinstance(row, SheetRow):
+        return row
+
+    d = row.to_dict()
+    names = d.keys()
+    return SheetRow(tuple(d[name] for name in names),
+                    dict((name, position)
+                         for position, name in enumerate(names)))
+
+
+def rows_from_cells(cells):
+    """
+        Converts the cells of a worksheet into SheetRows. The first row is used
+        as the header row, and, as in the list feed, rows stop at the first
+        blank row.
+
+        Input:  cells - an iterable of (row number, column number, value)
+                        tuples for the non-blank cells of the worksheet,
+                        numbered from 1
+        Output: A list of SheetRow instances, one per row below the header
+    """
+    grid = {}
+    width = 0
+    for row, col, value in cells:
+        grid.setdefault(row, {})[col - 1] = value
+        width = max(width, col)
+
+    columns = header_columns(grid.get(1, {}))
+    rows = []
+    row = 2
+    while row in grid:
+        cells_by_position = grid[row]
+        rows.append(SheetRow(tuple(cells_by_position.get(position)
+                                   for position in xrange(width)),
+                             columns))
+        row += 1
+
+    return rows
@@ -1,4 +1,7 @@
 # coding=utf-8
+import Queue
+import threading
+import time
 from socket import error as socketError
 from httplib import BadStatusLine, HTTPException
 from google.appengine.api.urlfetch_errors import DeadlineExceededError
@@ -29,3 +32,92 @@ def tryXTimes(func, times=5):
 
     logging.info('Final Try')
     return func()
+
+
+class RateLimiter(object):
+    """
+        Limits how often an action is taken, across all threads sharing the
+        RateLimiter.
+    """
+
+    def __init__(self, rate):
+        """
+            Input: rate - the maximum number of actions per second
+        """
+        self.interval = 1.0 / rate
+        self.__lock__ = threading.Lock()
+        self.__nextTime__ = time.time()
+
+    def wait(self):
+        """
+            Blocks until the next action may be taken without exceeding the
+            rate.
+        """
+        with self.__lock__:
+            now = time.time()
+            delay = self.__nextTime__ - now
+            self.__nextTime__ = max(now, self.__nextTime__) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+def runConcurrently(func, items, workers=1, rate_limit=None):
+    """
+        Calls the provided function on each of the provided items using a
+        bounded pool of worker threads, so that the time taken is bounded by
+        the slowest items rather than the sum of all items. With a single
+        worker, items are simply processed one after another in the calling
+        thread.
+
+        Input:  func - a function that takes one item
+                items - an iterable of items to call func on
+                workers - the maximum number of threads to run at once
+                rate_limit - optional maximum number of calls of func to
+                             start per second, across all threads, or a
+                             RateLimiter to share with other callers
+        Output: a list of the results of func, in the same order as items
+        Throws: the first exception raised by func, once every item has been
+                processed
+    """
+    items = list(items)
+    if rate_limit:
+        limiter = rate_limit
+        if not isinstance(limiter, RateLimiter):
+            limiter = RateLimiter(rate_limit)
+        limited_func = func
+
+        def func(item):
+            limiter.wait()
+            return limited_func(item)
+
+    if workers <= 1 or len(items) <= 1:
+        return [func(item) for item in items]
+
+    tasks = Queue.Queue()
+    for task in enumerate(items):
+        tasks.put(task)
+    results = [None] * len(items)
+    errors = []
+
+    def work():
+        while True:
+            try:
+                i, item = tasks.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                results[i] = func(item)
+            except Exception as e:
+                logging.exception(e)
+                errors.append(e)
+
+    threads = [threading.Thread(target=work)
+               for i in range(min(workers, len(items)))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    if errors:
+        raise errors[0]
+    return results
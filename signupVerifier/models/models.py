@@ -46,6 +46,34 @@ def verifyOrGet(cls, challenge):
         raise TypeError('challenge must be either string or %s' % str(cls))
 
 
+def keyFor(cls, challenge):
+    """
+        Returns the Key that the provided challenge refers to, without
+        fetching the instance of the provided class from the database. Accepts
+        the same forms of challenge as verifyOrGet, so that many challenges can
+        be converted to keys and fetched with a single db.get.
+
+        Input:  cls - The class that the challenge refers to an instance of.
+                challenge - Either an instance of cls, a Key, or a string that
+                            is the key or id of an instance of cls.
+        Output: A Key
+        Throws: TypeError if challenge is not a string, Key or cls instance
+    """
+    if isinstance(challenge, cls):
+        return challenge.key()
+
+    if isinstance(challenge, db.Key):
+        return challenge
+
+    if isinstance(challenge, basestring):
+        try:
+            return db.Key(challenge)
+        except db.BadKeyError:
+            return db.Key.from_path(cls.kind(), long(challenge))
+    else:
+        raise TypeError('challenge must be either string or %s' % str(cls))
+
+
 class Batch(db.Model):
     """ Represents a batch of sign-ups gathered at a particular event and
     entered by a particular staff person."""
@@ -125,6 +153,18 @@ class Person(db.Model):
     yrly_income = db.IntegerProperty()
     source_batch = db.ReferenceProperty(Batch, collection_name='persons',
                                         required=True)
+    # Status, denormalized from Bounce, OptOut and PersonChange so that
+    # reports can filter on it instead of querying each Person's collections.
+    # Maintained by createBounce, createOptOut and addPersonChange.
+    bounced = db.BooleanProperty(default=False)
+    opted_out = db.BooleanProperty(default=False)
+    superseded = db.BooleanProperty(default=False)
+
+    def resetStatus(self):
+        """ Clears the status flags, e.g. of a Person cloned from another"""
+        self.bounced = False
+        self.opted_out = False
+        self.superseded = False
 
     def asDict(self):
         """ Returns the instance of Person as a dict"""
@@ -165,6 +205,61 @@ class BatchSpreadsheet(db.Model):
     title = db.StringProperty()
     url = db.LinkProperty()
 
+    @classmethod
+    def keyName(cls, gsid):
+        """
+            Returns the key name used for the BatchSpreadsheet of the provided
+            Google Spreadsheet ID, so that whether a spreadsheet has already
+            been processed can be checked with a get instead of a query. Key
+            names may not begin with a digit, hence the prefix.
+        """
+        return 'gsid:%s' % gsid
+
+
+class DriveSyncState(db.Model):
+    """ How far the spreadsheets of a Google Drive folder have been discovered,
+    so that later crawls only need to look at what changed since"""
+    # The largest changestamp of the Google Drive changes seen by the last
+    # crawl, or None if the folder must be crawled in full
+    changestamp = db.IntegerProperty()
+    # The IDs of the spreadsheets that failed to be processed by the last
+    # crawl, which are tried again by the next one
+    retry_gsids = db.StringListProperty()
+    synced = db.DateTimeProperty(auto_now=True)
+
+    @classmethod
+    def keyName(cls, folder_id):
+        """
+            Returns the key name used for the DriveSyncState of the provided
+            Google Drive folder ID. Key names may not begin with a digit, hence
+            the prefix.
+        """
+        return 'folder:%s' % folder_id
+
+    @classmethod
+    def forFolder(cls, folder_id):
+        """
+            Returns the DriveSyncState of the provided Google Drive folder ID,
+            creating it if the folder has never been crawled.
+        """
+        return cls.get_or_insert(cls.keyName(folder_id))
+
+
+class MigrationState(db.Model):
+    """ Records that a one-off data migration, like a backfill, has finished,
+    keyed by the migration's name"""
+    completed = db.DateTimeProperty(auto_now_add=True)
+
+    @classmethod
+    def isCompleted(cls, name):
+        """ Indicates whether the migration of the provided name finished"""
+        return cls.get_by_key_name(name) is not None
+
+    @classmethod
+    def markCompleted(cls, name):
+        """ Records that the migration of the provided name finished"""
+        cls(key_name=name).put()
+
 
 class OptOutToken(db.Model):
     """ The tokens used to associate an opt-out request with a person and
@@ -34,3 +34,83 @@ def clone_entity(e, skip_auto_now=False, skip_auto_now_add=False, **extra_args):
       props[k] = value
   props.update(extra_args['extra_args'])
   return klass(**props)
+
+
+# The Datastore accepts at most 500 entities in a single put
+PUT_CHUNK_SIZE = 500
+
+# The Datastore accepts at most 30 values in a single IN filter
+IN_FILTER_SIZE = 30
+
+
+def putInChunks(models, chunk_size=PUT_CHUNK_SIZE):
+    """
+    Saves the provided models to the database using one db.put call per
+    chunk_size models, rather than one call per model.
+
+    Input:  models - a list of Model instances to save. Models of different
+                     kinds may be mixed.
+            chunk_size - the maximum number of models to save per db.put call
+    Output: a list of (chunk, error) tuples, one per db.put call made. chunk is
+            the list of models that were saved by the call, and error is None
+            if the call succeeded, or the exception it raised otherwise.
+    Side Effect: the provided models are saved to the database
+    """
+    results = []
+    for i in range(0, len(models), chunk_size):
+        chunk = models[i:i + chunk_size]
+        try:
+            db.put(chunk)
+            results.append((chunk, None))
+        except Exception as e:
+            logging.exception(e)
+            results.append((chunk, e))
+    return results
+
+
+def prefetchReferences(entities, reference_property):
+    """
+    Fetches the models referenced by a ReferenceProperty of each of the
+    provided entities with a single db.get, instead of one get per entity as
+    happens when the property is dereferenced. The fetched models are also
+    cached on the entities, so later dereferences do not hit the database.
+
+    Input:  entities - a list of Model instances
+            reference_property - the ReferenceProperty of the entities' class
+                                 to fetch, e.g. Bounce.person
+    Output: a list of the referenced models, in the same order as entities.
+            An entry is None if the referenced model no longer exists.
+    """
+    keys = [reference_property.get_value_for_datastore(entity)
+            for entity in entities]
+    if not keys:
+        return []
+
+    models = db.get(keys)
+    for entity, model in zip(entities, models):
+        if model is not None:
+            setattr(entity, reference_property.name, model)
+    return models
+
+
+def referencedKeys(reference_property, keys):
+    """
+    Finds which of the provided keys are referenced by the provided
+    ReferenceProperty of at least one entity, using one query per
+    IN_FILTER_SIZE keys instead of one query per key. The Datastore does not
+    allow projecting a property that is filtered on with IN, so whole
+    entities are fetched.
+
+    Input:  reference_property - the ReferenceProperty to search on, e.g.
+                                 Bounce.person
+            keys - a list of keys of the class the property refers to
+    Output: a set containing the provided keys that are referenced
+    """
+    name = reference_property.name
+    referenced = set()
+    for i in range(0, len(keys), IN_FILTER_SIZE):
+        q = reference_property.model_class.all()
+        q.filter('%s IN' % name, keys[i:i + IN_FILTER_SIZE])
+        referenced.update(reference_property.get_value_for_datastore(entity)
+                          for entity in q.run())
+    return referenced
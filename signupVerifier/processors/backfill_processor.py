@@ -0,0 +1,115 @@
+# coding=utf-8
+from google.appengine.api import taskqueue
+
+from ..models import Person, PersonChange, Bounce, OptOut, MigrationState
+from ..models.utils import putInChunks, referencedKeys
+
+import logging
+
+# Number of Persons backfilled per call of backfillPersonStatus
+BACKFILL_PAGE_SIZE = 300
+
+# Name of the MigrationState recorded once every Person has been backfilled
+PERSON_STATUS_BACKFILL = 'person_status_backfill'
+
+# Name of the task that starts the backfill. Task names are unique, so the
+# backfill is only started once however many requests ask for it.
+PERSON_STATUS_BACKFILL_TASK = 'backfill-person-status'
+
+# Whether the backfill is known to have finished, to skip the lookup
+backfilled = False
+
+
+def setPersonStatus(persons):
+    """
+    Sets the bounced, opted_out and superseded flags of the provided Persons
+    from their Bounces, OptOuts and PersonChanges, with a few queries for all
+    of them rather than a few per Person.
+
+    Input:  persons - a list of Person instances
+    Output: the provided list
+    Side Effect: the flags of the Persons are set, but they are not saved
+    """
+    keys = [person.key() for person in persons]
+    bounced = referencedKeys(Bounce.person, keys)
+    opted_out = referencedKeys(OptOut.person, keys)
+    superseded = referencedKeys(PersonChange.prev_person, keys)
+    for person in persons:
+        person.bounced = person.key() in bounced
+        person.opted_out = person.key() in opted_out
+        person.superseded = person.key() in superseded
+    return persons
+
+
+def iterWithPersonStatus(persons, page_size=BACKFILL_PAGE_SIZE):
+    """
+    Yields the Persons of the provided iterable with their status flags set
+    by setPersonStatus, one page of Persons at a time.
+    """
+    page = []
+    for person in persons:
+        page.append(person)
+        if len(page) >= page_size:
+            for person in setPersonStatus(page):
+                yield person
+            page = []
+    for person in setPersonStatus(page):
+        yield person
+
+
+def isPersonStatusBackfilled():
+    """
+    Indicates whether every Person saved before the status flags existed has
+    been backfilled, so that queries may filter on the flags. Until then, the
+    flags of existing Persons must be worked out with setPersonStatus.
+    """
+    global backfilled
+    if not backfilled:
+        backfilled = MigrationState.isCompleted(PERSON_STATUS_BACKFILL)
+    return backfilled
+
+
+def startPersonStatusBackfill():
+    """
+    Queues the task that backfills the status flags of every Person, unless
+    it has already been queued.
+    """
+    try:
+        taskqueue.add(url='/backfill_person_status',
+                      name=PERSON_STATUS_BACKFILL_TASK)
+        logging.info('Started backfilling Person status')
+    except (taskqueue.TaskAlreadyExistsError,
+            taskqueue.TombstonedTaskError):
+        pass
+
+
+def backfillPersonStatus(cursor=None, page_size=BACKFILL_PAGE_SIZE):
+    """
+    Sets the bounced, opted_out and superseded flags of one page of Persons
+    from their Bounces, OptOuts and PersonChanges. Every Person in the page is
+    saved, even if its flags did not change, so that Persons saved before the
+    flags existed are added to the flags' indexes. Once the last page has been
+    backfilled, this is recorded so that isPersonStatusBackfilled is True.
+
+    Input:  cursor - optional cursor string returned by a previous call,
+                     indicating the page of Persons to backfill
+            page_size - the number of Persons to backfill
+    Output: a cursor string for the next page of Persons, or None if there
+            are no more Persons to backfill
+    Side Effect: the Persons of the page are saved to the database
+    """
+    q = Person.all()
+    if cursor:
+        q.with_cursor(cursor)
+    persons = q.fetch(page_size)
+
+    setPersonStatus(persons)
+    for chunk, error in putInChunks(persons):
+        if error:
+            raise error
+    logging.info('Backfilled status of %s Persons' % len(persons))
+
+    if len(persons) < page_size:
+        MigrationState.markCompleted(PERSON_STATUS_BACKFILL)
+        return None
+    return q.cursor()
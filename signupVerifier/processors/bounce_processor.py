@@ -1,5 +1,6 @@
 # coding=utf-8
 
+from google.appengine.ext import db
 from ..models import Bounce, Person
 import datetime as dt
 
@@ -29,7 +30,14 @@ def createBounce(person, message, bounce_datetime=None):
         
     else:
         bounce = Bounce(person=person, batch=batch, message=message)
-    bounce.put()
+
+    # Save the bounce and flag the person as bounced together
+    def txn():
+        flagged_person = Person.get(person.key())
+        flagged_person.bounced = True
+        db.put([bounce, flagged_person])
+    db.run_in_transaction_options(db.create_transaction_options(xg=True), txn)
+    person.bounced = True
     return bounce
 
 def createBounceFromEmailAddress(address, message, bounce_datetime=None):
@@ -1,6 +1,5 @@
 # coding=utf-8
 import datetime as dt
-from google.appengine.ext.webapp import template
 from google.appengine.api import mail
 
 
@@ -8,7 +7,10 @@ from StringIO import StringIO
 from ..models import Batch
 from ..io.utils import tryXTimes
 from ..settings import settings
+from ..template_registry import templates
 
+from backfill_processor import isPersonStatusBackfilled, \
+    startPersonStatusBackfill, iterWithPersonStatus
 from unicode_csv import UnicodeDictWriter
 
 import logging
@@ -121,9 +123,22 @@ def getSuccessfulSignups(batch):
     Output: an interable of Person instances who did not bounce or opt-out.
     """
     batch = Batch.verifyOrGet(batch)
-    for person in batch.persons.run():
-        if not person.bounces.get() and not person.optouts.get():
-            yield person
+    if not isPersonStatusBackfilled():
+        # Persons saved before the status flags existed do not have them, so
+        # equality filters on the flags would leave them out
+        logging.warning('Person status has not been backfilled yet; '
+                        'working it out for each Person')
+        startPersonStatusBackfill()
+        for person in iterWithPersonStatus(batch.persons.run()):
+            if not person.bounced and not person.opted_out:
+                yield person
+        return
+
+    q = batch.persons
+    q.filter('bounced =', False)
+    q.filter('opted_out =', False)
+    for person in q.run():
+        yield person
 
 
 def emailCsvs(csvs, batches, email_template=csvs_ready_template):
@@ -137,7 +152,7 @@ def emailCsvs(csvs, batches, email_template=csvs_ready_template):
     Output: True if successful, False otherwise
     Side Effect: An email is sent to the provided address.
     """
-    email_html = template.render(email_template, {'batches': batches})
+    email_html = templates.render(email_template, {'batches': batches})
     message = mail.EmailMessage(sender=settings['app_email_address'],
                                 subject=settings['subject_csvsReady'])
     message.to = settings['admin_email_address']
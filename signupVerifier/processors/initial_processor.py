@@ -1,12 +1,16 @@
 # coding=utf-8
 from urllib import urlencode
-from google.appengine.ext.webapp import template
+from google.appengine.ext import db
 from google.appengine.api import mail
 
 from ..settings import settings
-from ..models import Batch, BatchChange, Person, PersonChange
-from ..models.utils import clone_entity
-from ..io.utils import tryXTimes
+from ..template_registry import templates
+from ..models import Batch, BatchChange, Person, PersonChange, OptOutToken,\
+    keyFor
+from ..models.utils import clone_entity, putInChunks
+from ..io.utils import tryXTimes, runConcurrently
+
+import logging
 
 
 verification_email_template = \
@@ -127,11 +131,18 @@ def addPersonChange(person, prev_person):
     prev_person = Person.verifyOrGet(prev_person)
 
     cur_person = clone_entity(prev_person, True, True, extra_args=person)
+    cur_person.resetStatus()
     cur_person.put()
 
-    change_record = PersonChange(cur_person=cur_person,
-                        prev_person=prev_person)
-    change_record.put()
+    # Save the change and flag the previous person as superseded together
+    def txn():
+        change_record = PersonChange(cur_person=cur_person,
+                            prev_person=prev_person)
+        flagged_person = Person.get(prev_person.key())
+        flagged_person.superseded = True
+        db.put([change_record, flagged_person])
+    db.run_in_transaction_options(db.create_transaction_options(xg=True), txn)
+    prev_person.superseded = True
 
     return cur_person
 
@@ -155,8 +166,134 @@ def importPersons(persons, batch):
     return person_records
 
 
+def importPersonsBulk(persons, batch, batch_log=None):
+    """
+    Imports the provided persons, associated with the indicated batch, into
+    the database, and creates an OptOutToken for each imported Person. Unlike
+    importPerson and addPersonChange, all Person, PersonChange and OptOutToken
+    models are built in memory first and then saved with chunked db.put
+    calls, so the number of Datastore round trips grows with the number of
+    chunks rather than with the number of persons.
+
+    Input:  persons - a List of dicts representing persons to save to the
+                      database. A dict containing a person_id is imported as a
+                      change to the previously existing Person with that ID,
+                      as addPersonChange would.
+            batch - the ID or instance of the Batch model that these persons
+                    are to be associated with.
+            batch_log - optional batch_log data structure. Must have a
+                persons_fail list attribute. If provided, a (person, error)
+                tuple is appended to persons_fail for each person that could
+                not be imported.
+    Output: a tuple of the List of Person models created by the import, and a
+            dict mapping keys of those Person models to their OptOutToken.
+    Side Effect: Entries are saved to the database for each person, for each
+                 person's opt-out token, and for each association between a
+                 changed person and its previous instance. Previous instances
+                 are flagged as superseded, though unlike addPersonChange not
+                 in the same transaction as the association.
+    Throws: If batch_log is not provided, any encountered exceptions will
+            bubble up.
+    """
+    batch = Batch.verifyOrGet(batch)
+
+    def fail(person, e):
+        if batch_log is None:
+            raise e
+        logging.exception(e)
+        batch_log['persons_fail'].append((person, e))
+
+    # 1.) Fetch the previous instances of all changed persons at once
+    prev_keys = {}
+    for i, person in enumerate(persons):
+        if not isinstance(person, dict):
+            fail(person, TypeError('Expected person to be dict'))
+        elif 'person_id' in person:
+            try:
+                prev_keys[i] = keyFor(Person, person['person_id'])
+            except Exception as e:
+                fail(person, e)
+    prev_persons = dict(zip(prev_keys.keys(),
+                            db.get(prev_keys.values()) if prev_keys else []))
+
+    # 2.) Build the Person models
+    pending = []
+    for i, person in enumerate(persons):
+        if not isinstance(person, dict):
+            continue
+        try:
+            if 'person_id' in person:
+                if i not in prev_persons:
+                    continue
+                prev_person = prev_persons[i]
+                if not isinstance(prev_person, Person):
+                    raise LookupError('provided key could not be found: %s' %
+                                      person['person_id'])
+                person['source_batch'] = batch.key()
+                person_record = clone_entity(prev_person, True, True,
+                                             extra_args=person)
+                person_record.resetStatus()
+            else:
+                prev_person = None
+                person_record = Person(email=person['email'],
+                                       first_name=person['first_name'],
+                                       last_name=person['last_name'],
+                                       full_name=person['full_name'],
+                                       source_batch=batch)
+                for key, value in person.iteritems():
+                    setattr(person_record, key, value)
+            pending.append((person, person_record, prev_person))
+        except Exception as e:
+            fail(person, e)
+
+    # 3.) Save the Person models, so that they have keys to be referenced by
+    # OptOutTokens and PersonChanges
+    errors = {}
+    for chunk, error in putInChunks([record for _, record, _ in pending]):
+        if error:
+            for person_record in chunk:
+                errors[id(person_record)] = error
+
+    # 4.) Build and save the OptOutToken and PersonChange models
+    tokens = {}
+    owners = {}
+    dependents = []
+    for person, person_record, prev_person in pending:
+        if id(person_record) in errors:
+            continue
+        token = OptOutToken(batch=batch, person=person_record)
+        tokens[id(person_record)] = token
+        dependents.append(token)
+        owners[id(token)] = person_record
+        if prev_person:
+            change_record = PersonChange(cur_person=person_record,
+                                         prev_person=prev_person)
+            dependents.append(change_record)
+            owners[id(change_record)] = person_record
+            prev_person.superseded = True
+            dependents.append(prev_person)
+            owners[id(prev_person)] = person_record
+
+    for chunk, error in putInChunks(dependents):
+        if error:
+            for model in chunk:
+                errors[id(owners[id(model)])] = error
+
+    person_records = []
+    optout_tokens = dict()
+    for person, person_record, prev_person in pending:
+        if id(person_record) in errors:
+            fail(person, errors[id(person_record)])
+        else:
+            person_records.append(person_record)
+            optout_tokens[person_record.key()] = tokens[id(person_record)]
+
+    return (person_records, optout_tokens)
+
+
 def sendVerificationEmails(batch, persons=None, optout_tokens=None,
-        optout_base_url='http://localhost/optout', batch_log=None):
+        optout_base_url='http://localhost/optout', batch_log=None,
+        concurrency=1, rate_limit=None):
     """
     Generates an email based on the metadata of the provided batch, each
     person in the batch, and each person's opt-out token. Then sends the
@@ -179,6 +316,10 @@ def sendVerificationEmails(batch, persons=None, optout_tokens=None,
             batch_log - option batch_log data structure. Must have
                 persons_success and persons_fail list attributes. If no log is
                 provided, then no logging will occur.
+            concurrency - the number of emails to send at once. All emails
+                are prepared first, then sent by this many worker threads.
+            rate_limit - optional maximum number of emails to send per second,
+                or a RateLimiter shared with other calls.
     Output: a modified batch_log if batch_log is provided. Otherwise,  True if
             verification emails are sent successfully, False otherwise.
     Side Effect: Emails are sent to all Person associated with the Batch
@@ -206,6 +347,8 @@ def sendVerificationEmails(batch, persons=None, optout_tokens=None,
         else:
             raise e
 
+    # Prepare all of the messages, then send them from a pool of workers
+    messages = []
     for person in persons:
         try:
             optout_token = optout_tokens[person.key()]
@@ -220,9 +363,9 @@ def sendVerificationEmails(batch, persons=None, optout_tokens=None,
                 'subject': settings['subject_initial_user']
             }
 
-            email_html = template.render(verification_email_template,
+            email_html = templates.render(verification_email_template,
                             template_values)
-            email_text = template.render(verification_email_template_text,
+            email_text = templates.render(verification_email_template_text,
                             template_values)
             message = mail.EmailMessage(sender=settings['app_email_address'],
                             subject=settings['subject_initial_user'])
@@ -230,14 +373,31 @@ def sendVerificationEmails(batch, persons=None, optout_tokens=None,
             message.reply_to = settings['optout_email_address']
             message.html = email_html
             message.body = email_text
-            tryXTimes(lambda: message.send())
-
-            if batch_log:
-                batch_log['persons_success'].append(person)
+            messages.append((person, message))
         except Exception as e:
             if batch_log:
                 batch_log['persons_fail'].append((person, e))
             else:
                 raise e
 
+    def send(prepared):
+        person, message = prepared
+        try:
+            tryXTimes(lambda: message.send())
+            return (person, None)
+        except Exception as e:
+            logging.exception(e)
+            return (person, e)
+
+    # Results are reported from this thread, in the order of persons
+    for person, e in runConcurrently(send, messages, concurrency,
+                                     rate_limit):
+        if e is None:
+            if batch_log:
+                batch_log['persons_success'].append(person)
+        elif batch_log:
+            batch_log['persons_fail'].append((person, e))
+        else:
+            raise e
+
     return batch_log if batch_log else True
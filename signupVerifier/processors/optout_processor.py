@@ -1,6 +1,7 @@
 # coding=utf-8
 
 from ..models import Batch, Person, OptOutToken, OptOut 
+from google.appengine.ext import db
 from google.appengine.ext.db import delete as modelDelete
 import datetime as dt
 
@@ -99,7 +100,14 @@ def createOptOut(person, batch, reason):
     optout = OptOut(person=person,
                     batch=batch,
                     reason=reason)
-    optout.put()
+
+    # Save the optout and flag the person as opted out together
+    def txn():
+        flagged_person = Person.get(person.key())
+        flagged_person.opted_out = True
+        db.put([optout, flagged_person])
+    db.run_in_transaction_options(db.create_transaction_options(xg=True), txn)
+    person.opted_out = True
     return optout 
 
 def createOptOutFromEmailAddress(address, message, optout_datetime=None):
@@ -0,0 +1,80 @@
+# coding=utf-8
+import threading
+import time
+from google.appengine.ext.webapp import template
+
+import logging
+
+
+class TemplateRegistry(object):
+    """
+        Loads and compiles each template once per process, so that rendering
+        a template is only a context substitution, rather than the template
+        file being resolved and loaded on every render. Also counts how many
+        times, and for how long in total, each template has been rendered.
+    """
+
+    def __init__(self):
+        self.__compiled__ = {}
+        self.__counters__ = {}
+        self.__lock__ = threading.Lock()
+
+    def load(self, path):
+        """
+            Returns the compiled template at the provided path, loading and
+            compiling it if this is the first time it has been asked for.
+
+            Input:  path - path of the template, relative to the app's root
+            Output: a compiled template
+        """
+        compiled = self.__compiled__.get(path)
+        if compiled is None:
+            with self.__lock__:
+                compiled = self.__compiled__.get(path)
+                if compiled is None:
+                    logging.debug('Compiling template %s' % path)
+                    compiled = template.load(path)
+                    self.__compiled__[path] = compiled
+                    self.__counters__[path] = {'renders': 0, 'seconds': 0.0}
+        return compiled
+
+    def render(self, path, values):
+        """
+            Renders the template at the provided path with the provided values.
+            A drop in replacement for webapp's template.render.
+
+            Input:  path - path of the template, relative to the app's root
+                    values - a dict of the values to render the template with
+            Output: the rendered template as a string
+        """
+        compiled = self.load(path)
+        start = time.time()
+        rendered = compiled.render(template.Context(values))
+        elapsed = time.time() - start
+
+        with self.__lock__:
+            counter = self.__counters__[path]
+            counter['renders'] += 1
+            counter['seconds'] += elapsed
+        return rendered
+
+    def counters(self):
+        """
+            Returns a dict mapping the path of each loaded template to a dict
+            of its number of renders and total seconds spent rendering.
+        """
+        with self.__lock__:
+            return dict((path, dict(counter))
+                        for path, counter in self.__counters__.iteritems())
+
+    def logCounters(self):
+        """
+            Logs the render counters of every loaded template.
+        """
+        for path, counter in sorted(self.counters().iteritems()):
+            logging.info('Rendered %s %s times in %.3f seconds' %
+                         (path, counter['renders'], counter['seconds']))
+
+
+# The registry shared by the whole process
+templates = TemplateRegistry()
@@ -0,0 +1,206 @@
+# coding=utf-8
+"""
+    Validation of the rows of signup spreadsheets. Rows are validated a whole
+    column at a time against a table of rules, using precompiled patterns.
+
+    This module does not depend on App Engine or the Google APIs, so that
+    exported spreadsheets can be checked offline before they are uploaded:
+
+        python -m signupVerifier.validation signups.csv [...]
+"""
+import csv
+import re
+import sys
+
+from .io.sheet_rows import list_column_name, header_columns
+
+EMAIL_PATTERN = re.compile(r"[^@;]+@[^@]+\.[^@;]+")
+INTEGER_PATTERN = re.compile(r"\s*[-+]?\d+\s*$")
+DATE_PATTERN = re.compile(r"\s*\d{1,2}/\d{1,2}/\d{4}\s*$")
+
+# Headers that the header row of a Raw sheet must have, as list feed names
+required_person_headers = ['email', 'firstname', 'lastname', 'fullname']
+
+# Error codes
+MISSING_EMAIL = 'missing_email'
+MALFORMED_EMAIL = 'malformed_email'
+MISSING_FIRST_NAME = 'missing_first_name'
+MISSING_LAST_NAME = 'missing_last_name'
+MISSING_FULL_NAME = 'missing_full_name'
+NO_FORUMS = 'no_forums'
+MALFORMED_NUM_IN_HOUSE = 'malformed_num_in_house'
+MALFORMED_YRLY_INCOME = 'malformed_yrly_income'
+MISSING_STAFF_EMAIL = 'missing_staff_email'
+MALFORMED_STAFF_EMAIL = 'malformed_staff_email'
+MALFORMED_EVENT_DATE = 'malformed_event_date'
+
+error_messages = {
+    MISSING_EMAIL: 'Missing email address',
+    MALFORMED_EMAIL: 'Malformed email address',
+    MISSING_FIRST_NAME: 'Missing first name',
+    MISSING_LAST_NAME: 'Missing last name',
+    MISSING_FULL_NAME: 'Missing full name',
+    NO_FORUMS: 'No forums selected for the user',
+    MALFORMED_NUM_IN_HOUSE: 'Malformed number in house',
+    MALFORMED_YRLY_INCOME: 'Malformed yearly income',
+    MISSING_STAFF_EMAIL: 'Missing staff email address',
+    MALFORMED_STAFF_EMAIL: 'Malformed staff email address',
+    MALFORMED_EVENT_DATE: 'Malformed event date, expected MM/DD/YYYY'
+}
+
+
+def isBlank(value):
+    return value is None or not value.strip()
+
+
+def isPresent(value):
+    return not isBlank(value)
+
+
+def matchesOrBlank(pattern):
+    """
+        Returns a check that passes blank values and values matching the
+        provided pattern.
+    """
+    return lambda value: isBlank(value) or pattern.match(value) is not None
+
+
+# Rules for the rows of a Raw sheet, as (column name, error code, check)
+# tuples. A check is called with a column's value and returns True if the value
+# is valid. A column name ending with * stands for the first non-blank value
+# of all columns whose names start with the rest of it. Error codes are
+# reported in the order of the rules.
+person_rules = [
+    ('email', MISSING_EMAIL, isPresent),
+    ('email', MALFORMED_EMAIL, matchesOrBlank(EMAIL_PATTERN)),
+    ('firstname', MISSING_FIRST_NAME, isPresent),
+    ('lastname', MISSING_LAST_NAME, isPresent),
+    ('fullname', MISSING_FULL_NAME, isPresent),
+    ('forum*', NO_FORUMS, lambda value: value is not None),
+    ('inhouse', MALFORMED_NUM_IN_HOUSE, matchesOrBlank(INTEGER_PATTERN)),
+    ('yrlyincome', MALFORMED_YRLY_INCOME, matchesOrBlank(INTEGER_PATTERN)),
+]
+
+# Rules for the row of a Meta sheet
+meta_rules = [
+    ('staffemail', MISSING_STAFF_EMAIL, isPresent),
+    ('staffemail', MALFORMED_STAFF_EMAIL, matchesOrBlank(EMAIL_PATTERN)),
+    ('eventdate', MALFORMED_EVENT_DATE, matchesOrBlank(DATE_PATTERN)),
+]
+
+
+def columnVector(columns, name, row_count):
+    """
+        Returns the values of the column of the provided name, following the
+        naming conventions of the rule tables.
+    """
+    if not name.endswith('*'):
+        return columns.get(name) or (None,) * row_count
+
+    prefix = name[:-1]
+    vectors = [vector for column_name, vector in sorted(columns.iteritems())
+               if column_name.startswith(prefix)]
+    return [next((value for value in values if value is not None), None)
+            for values in zip(*vectors)] if vectors else (None,) * row_count
+
+
+def validateColumns(columns, rules=person_rules):
+    """
+        Validates rows a whole column at a time.
+
+        Input:  columns - a dict mapping list feed column names to sequences
+                          of values, one value per row, None for blank cells
+                rules - the rule table to validate the rows against
+        Output: A list with one list of error codes per row. The list of a
+                valid row is empty.
+    """
+    row_count = max(len(vector) for vector in columns.itervalues()) \
+        if columns else 0
+    errors = [[] for i in xrange(row_count)]
+    for name, code, check in rules:
+        vector = columnVector(columns, name, row_count)
+        for i, value in enumerate(vector):
+            if not check(value):
+                errors[i].append(code)
+
+    return errors
+
+
+def validateDict(d, rules=person_rules):
+    """
+        Validates a single row given as a dict of list feed column name ->
+        value, and returns its list of error codes.
+    """
+    return validateColumns(dict((name, (value,))
+                                for name, value in d.iteritems()), rules)[0]
+
+
+def errorMessages(codes):
+    """ Returns the human readable messages of the provided error codes"""
+    return [error_messages[code] for code in codes]
+
+
+def preflightCsv(csv_file, max_header_rows=10):
+    """
+        Validates the persons in a CSV export of a Raw sheet, without any
+        requests to Google. As on Google Drive, the header row is looked for
+        among the first rows, and rows stop at the first blank row.
+
+        Input:  csv_file - a file object of the CSV to validate
+                max_header_rows - the number of rows to search for the header
+        Output: A list of (row number, error codes) tuples for the invalid
+                rows, numbered as in the spreadsheet
+        Throws: LookupError if there is no header row
+    """
+    reader = csv.reader(csv_file)
+    header = None
+    for header_row, cells in enumerate(reader, 1):
+        names = set(list_column_name(cell) for cell in cells)
+        if names.issuperset(required_person_headers):
+            header = cells
+            break
+        if header_row >= max_header_rows:
+            break
+    if header is None:
+        raise LookupError('No header row found in the first %s rows' %
+                          max_header_rows)
+
+    rows = []
+    for row in reader:
+        if not any(row):
+            break
+        rows.append(row + [''] * (len(header) - len(row)))
+
+    columns = dict((name, [row[position] or None for row in rows])
+                   for name, position
+                   in header_columns(dict(enumerate(header))).iteritems())
+
+    # Skip rows that are blank but for the Full Name formula, as the import
+    # does
+    required = [columnVector(columns, name, len(rows))
+                for name in required_person_headers]
+    return [(header_row + 1 + i, codes)
+            for i, codes in enumerate(validateColumns(columns))
+            if codes and not all(isBlank(vector[i]) for vector in required)]
+
+
+def main(paths):
+    invalid = False
+    for path in paths:
+        with open(path, 'rb') as csv_file:
+            try:
+                results = preflightCsv(csv_file)
+            except LookupError as e:
+                print '%s: %s' % (path, e)
+                invalid = True
+                continue
+        for row_number, codes in results:
+            print '%s:%s: %s' % (path, row_number,
+                                 '; '.join(errorMessages(codes)))
+        invalid = invalid or bool(results)
+
+    return 1 if invalid else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
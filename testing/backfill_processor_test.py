@@ -0,0 +1,133 @@
+# coding=utf-8
+"""
+Tests of the Person status backfill against the Datastore stub of the App
+Engine SDK. Run from the repository root, with the SDK on the PYTHONPATH:
+
+    python testing/backfill_processor_test.py
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+
+import dev_appserver
+dev_appserver.fix_sys_path()
+
+from google.appengine.datastore import datastore_stub_util
+from google.appengine.ext import testbed
+
+from signupVerifier.models import Batch, Person, PersonChange, Bounce, \
+    OptOut, MigrationState
+from signupVerifier.models.utils import referencedKeys, IN_FILTER_SIZE
+from signupVerifier.processors import backfill_processor
+from signupVerifier.processors.backfill_processor import \
+    backfillPersonStatus, setPersonStatus, isPersonStatusBackfilled, \
+    PERSON_STATUS_BACKFILL
+
+
+class BackfillTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        policy = datastore_stub_util.PseudoRandomHRConsistencyPolicy(
+            probability=1)
+        self.testbed.init_datastore_v3_stub(consistency_policy=policy)
+        self.testbed.init_memcache_stub()
+        backfill_processor.backfilled = False
+
+        self.batch = Batch(staff_name='Staff', staff_email='staff@example.com')
+        self.batch.put()
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def newPersons(self, count):
+        persons = [Person(email='person%s@example.com' % i,
+                          first_name='First', last_name='Last%s' % i,
+                          full_name='First Last%s' % i,
+                          source_batch=self.batch)
+                   for i in range(count)]
+        for person in persons:
+            person.put()
+        return persons
+
+
+class ReferencedKeysTest(BackfillTestCase):
+    """ referencedKeys finds the keys referenced by any entity"""
+
+    def testFindsReferencedKeys(self):
+        persons = self.newPersons(IN_FILTER_SIZE * 2 + 5)
+        bounced = persons[::7]
+        for person in bounced:
+            Bounce(person=person, batch=self.batch).put()
+        # Bounces referencing the same Person twice are found once
+        Bounce(person=bounced[0], batch=self.batch).put()
+
+        keys = [person.key() for person in persons]
+        self.assertEqual(referencedKeys(Bounce.person, keys),
+                         set(person.key() for person in bounced))
+
+    def testNoKeys(self):
+        self.assertEqual(referencedKeys(Bounce.person, []), set())
+
+
+class BackfillPersonStatusTest(BackfillTestCase):
+    """ The backfill sets the status flags of every Person, then records that
+    it has finished"""
+
+    def testSetPersonStatus(self):
+        bounced, opted_out, superseded, current = self.newPersons(4)
+        Bounce(person=bounced, batch=self.batch).put()
+        OptOut(person=opted_out, batch=self.batch).put()
+        PersonChange(prev_person=superseded, cur_person=current).put()
+
+        setPersonStatus([bounced, opted_out, superseded, current])
+        self.assertEqual(
+            [(p.bounced, p.opted_out, p.superseded)
+             for p in (bounced, opted_out, superseded, current)],
+            [(True, False, False), (False, True, False),
+             (False, False, True), (False, False, False)])
+
+    def testBackfillEndToEnd(self):
+        persons = self.newPersons(25)
+        for person in persons[:3]:
+            Bounce(person=person, batch=self.batch).put()
+        for person in persons[10:12]:
+            OptOut(person=person, batch=self.batch).put()
+        PersonChange(prev_person=persons[20], cur_person=persons[21]).put()
+        self.assertFalse(isPersonStatusBackfilled())
+
+        cursor = None
+        pages = 0
+        while True:
+            cursor = backfillPersonStatus(cursor, page_size=10)
+            pages += 1
+            if cursor is None:
+                break
+            self.assertFalse(MigrationState.isCompleted(
+                PERSON_STATUS_BACKFILL))
+        self.assertEqual(pages, 3)
+        self.assertTrue(isPersonStatusBackfilled())
+
+        keys = [person.key() for person in persons]
+        self.assertEqual(
+            set(Person.all(keys_only=True).filter('bounced =', True)),
+            set(keys[:3]))
+        self.assertEqual(
+            set(Person.all(keys_only=True).filter('opted_out =', True)),
+            set(keys[10:12]))
+        self.assertEqual(
+            set(Person.all(keys_only=True).filter('superseded =', True)),
+            set([keys[20]]))
+        self.assertEqual(
+            Person.all().filter('bounced =', False)
+                        .filter('opted_out =', False)
+                        .filter('superseded =', False).count(),
+            25 - 3 - 2 - 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
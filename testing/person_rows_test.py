@@ -0,0 +1,177 @@
+# coding=utf-8
+"""
+Tests of the conversion of Raw sheet rows into person dicts: the naming of
+header columns, the SheetRows read through the cells feed, and the
+PersonRowNormalizer, which GClient.personRowToDict and
+GClient.invalidPersonRow convert and validate rows with. Run from the
+repository root with:
+
+    python testing/person_rows_test.py
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'lib'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+
+import atom.core
+import gdata.spreadsheets.data
+from signupVerifier.io.sheet_rows import list_column_name, header_columns, \
+    rows_from_cells, sheet_row
+from signupVerifier.io.person_rows import PersonRowNormalizer
+from signupVerifier.validation import errorMessages, validateDict, \
+    MALFORMED_EMAIL, MISSING_LAST_NAME, NO_FORUMS, MALFORMED_NUM_IN_HOUSE
+
+# The part of GClient's person_key_map used by the rows below
+KEY_MAP = {
+    'first_name': 'firstname',
+    'last_name': 'lastname',
+    'full_name': 'fullname',
+    'num_in_house': 'inhouse',
+    'yrly_income': 'yrlyincome',
+    'born_out_of_us': 'bornoutofus',
+    'parents_born_out_of_us': 'parentsbornoutofus',
+    'delivery_setting': 'deliverysetting'
+}
+
+HEADERS = ['Email', 'First Name', 'Last Name', 'Full Name', 'Forum 2',
+           'Forum 1', 'In House', 'Yrly Income', 'Born Out Of US?',
+           'Parents Born Out Of US?', 'Delivery Setting', 'Notes']
+
+ROWS = [
+    # Valid, with values to strip and cast
+    ['ada@example.com', ' Ada ', 'Lovelace ', 'Ada Lovelace', 'Ward 1',
+     'Saint Paul', ' 3', '40000', 'Yes', 'no', None, ' a note '],
+    # Invalid
+    ['ada', 'Ada', None, 'Ada ', None, None, 'three', None, None, None,
+     'digest', None],
+    # Blank but for the Full Name formula
+    [None, None, None, ' ', None, None, None, None, None, None, None, None],
+]
+
+
+def cells(rows):
+    """ The (row, col, value) cells of the non-blank values of the header row
+    and the provided rows"""
+    return [(row, col, value)
+            for row, values in enumerate([HEADERS] + rows, 1)
+            for col, value in enumerate(values, 1)
+            if value is not None]
+
+
+def list_entry(values):
+    """ The list feed ListEntry of a row with the provided values, parsed from
+    XML as from the list feed, which has an element for every column"""
+    entry = gdata.spreadsheets.data.ListEntry()
+    for header, value in zip(HEADERS, values):
+        entry.set_value(list_column_name(header), value)
+    return atom.core.parse(entry.to_string(),
+                           gdata.spreadsheets.data.ListEntry)
+
+
+class HeaderColumnsTest(unittest.TestCase):
+    """ Columns are named as in the list feed"""
+
+    def testListColumnName(self):
+        self.assertEqual(list_column_name('Born Out Of US?'), 'bornoutofus')
+        self.assertEqual(list_column_name('Zip-Code 2.0'), 'zip-code2.0')
+        self.assertEqual(list_column_name(None), '')
+
+    def testHeaderColumns(self):
+        self.assertEqual(
+            header_columns({0: 'Email', 1: 'Forum', 2: '??', 4: 'forum',
+                            5: 'Forum!', 6: 'Forum_2'}),
+            {'email': 0, 'forum': 1, 'forum_2': 4, 'forum_3': 5,
+             'forum2': 6})
+
+
+class RowsFromCellsTest(unittest.TestCase):
+    """ The cells feed is read into rows like the list feed's"""
+
+    def testSparseRows(self):
+        rows = rows_from_cells([(1, 1, 'Email'), (1, 3, 'Notes'),
+                                (2, 3, 'a note'), (3, 1, 'ada@example.com'),
+                                (3, 4, 'no header'), (5, 1, 'after a gap')])
+        self.assertEqual([row.values for row in rows],
+                         [(None, None, 'a note', None),
+                          ('ada@example.com', None, None, 'no header')])
+        self.assertEqual(rows[0].to_dict(), {'email': None,
+                                             'notes': 'a note'})
+        self.assertEqual(rows[1].get_value('email'), 'ada@example.com')
+        self.assertEqual(rows[1].get_value('missing'), None)
+
+    def testNoRows(self):
+        self.assertEqual(rows_from_cells([(1, 1, 'Email')]), [])
+        self.assertEqual(rows_from_cells([]), [])
+
+
+class PersonRowNormalizerTest(unittest.TestCase):
+    """ Rows of the cells feed and of the list feed are converted and
+    validated the same way"""
+
+    def setUp(self):
+        self.rows = rows_from_cells(cells(ROWS))
+        self.normalizer = PersonRowNormalizer(self.rows[0].columns, KEY_MAP)
+
+    def testConvert(self):
+        self.assertEqual(self.normalizer.convert(self.rows[0]), {
+            'email': 'ada@example.com',
+            'first_name': 'Ada',
+            'last_name': 'Lovelace',
+            'full_name': 'Ada Lovelace',
+            'num_in_house': 3,
+            'yrly_income': 40000,
+            'born_out_of_us': True,
+            'parents_born_out_of_us': False,
+            'delivery_setting': 'email',
+            'notes': ' a note ',
+            'forums': ['Saint Paul', 'Ward 1']
+        })
+
+    def testConvertInvalid(self):
+        d = self.normalizer.convert(self.rows[1])
+        self.assertEqual(d['num_in_house'], 'three')
+        self.assertEqual(d['last_name'], None)
+        self.assertEqual(d['delivery_setting'], 'digest')
+        self.assertEqual(d['forums'], [])
+
+    def testValidate(self):
+        self.assertEqual(self.normalizer.validate(self.rows[:2]),
+                         [[], [MALFORMED_EMAIL, MISSING_LAST_NAME, NO_FORUMS,
+                               MALFORMED_NUM_IN_HOUSE]])
+        self.assertEqual(self.normalizer.validate(self.rows[:2]),
+                         [validateDict(row.to_dict())
+                          for row in self.rows[:2]])
+        self.assertEqual(self.normalizer.validate([]), [])
+
+    def testNormalizeSkipsBlankRows(self):
+        normalized = self.normalizer.normalize(self.rows)
+        self.assertEqual([row for row, d, errors in normalized],
+                         self.rows[:2])
+        self.assertEqual([errors for row, d, errors in normalized],
+                         [[], errorMessages([MALFORMED_EMAIL,
+                                             MISSING_LAST_NAME, NO_FORUMS,
+                                             MALFORMED_NUM_IN_HOUSE])])
+
+    def testListEntries(self):
+        # personRowToDict and invalidPersonRow convert list feed rows with
+        # sheet_row before normalizing them
+        for values, row in zip(ROWS, self.rows):
+            entry_row = sheet_row(list_entry(values))
+            normalizer = PersonRowNormalizer(entry_row.columns, KEY_MAP)
+            self.assertEqual(normalizer.convert(entry_row),
+                             self.normalizer.convert(row))
+            self.assertEqual(normalizer.validate([entry_row]),
+                             self.normalizer.validate([row]))
+            self.assertEqual(normalizer.isBlank(entry_row),
+                             self.normalizer.isBlank(row))
+
+    def testSheetRowsAreKept(self):
+        self.assertTrue(sheet_row(self.rows[0]) is self.rows[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
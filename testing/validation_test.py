@@ -0,0 +1,158 @@
+# coding=utf-8
+"""
+Tests of the rule tables of the validation module and of the CSV preflight.
+Run from the repository root with:
+
+    python testing/validation_test.py
+"""
+import os
+import sys
+import tempfile
+import unittest
+from StringIO import StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+
+from signupVerifier import validation
+from signupVerifier.validation import validateColumns, validateDict, \
+    columnVector, errorMessages, preflightCsv, meta_rules, \
+    MISSING_EMAIL, MALFORMED_EMAIL, MISSING_FIRST_NAME, MISSING_LAST_NAME, \
+    MISSING_FULL_NAME, NO_FORUMS, MALFORMED_NUM_IN_HOUSE, \
+    MALFORMED_YRLY_INCOME, MISSING_STAFF_EMAIL, MALFORMED_STAFF_EMAIL, \
+    MALFORMED_EVENT_DATE
+
+
+def person(**values):
+    """ A valid person row as a dict of list feed column name -> value, with
+    the provided values replaced"""
+    d = {
+        'email': 'ada@example.com',
+        'firstname': 'Ada',
+        'lastname': 'Lovelace',
+        'fullname': 'Ada Lovelace',
+        'forum1': 'Saint Paul',
+        'inhouse': '2',
+        'yrlyincome': '40000'
+    }
+    d.update(values)
+    return d
+
+
+class PersonRulesTest(unittest.TestCase):
+    """ Each rule of person_rules reports its error code"""
+
+    def testValidRow(self):
+        self.assertEqual(validateDict(person()), [])
+
+    def testEmail(self):
+        self.assertEqual(validateDict(person(email=None)), [MISSING_EMAIL])
+        self.assertEqual(validateDict(person(email='  ')), [MISSING_EMAIL])
+        for email in ('ada', 'ada@example', 'ada@b@example.com',
+                      'ada;b@example.com'):
+            self.assertEqual(validateDict(person(email=email)),
+                             [MALFORMED_EMAIL], email)
+
+    def testNames(self):
+        self.assertEqual(
+            validateDict(person(firstname=None, lastname=' ', fullname='')),
+            [MISSING_FIRST_NAME, MISSING_LAST_NAME, MISSING_FULL_NAME])
+
+    def testForums(self):
+        self.assertEqual(validateDict(person(forum1=None)), [NO_FORUMS])
+        self.assertEqual(validateDict(person(forum1=None, forum2='Ward 1')),
+                         [])
+        self.assertEqual(validateDict(dict((key, value) for key, value
+                                           in person().iteritems()
+                                           if key != 'forum1')),
+                         [NO_FORUMS])
+
+    def testNumbers(self):
+        self.assertEqual(validateDict(person(inhouse=' 3 ', yrlyincome='')),
+                         [])
+        self.assertEqual(validateDict(person(inhouse='three',
+                                             yrlyincome='40,000')),
+                         [MALFORMED_NUM_IN_HOUSE, MALFORMED_YRLY_INCOME])
+
+    def testErrorsInRuleOrder(self):
+        codes = validateDict({'inhouse': 'x'})
+        self.assertEqual(codes, [MISSING_EMAIL, MISSING_FIRST_NAME,
+                                 MISSING_LAST_NAME, MISSING_FULL_NAME,
+                                 NO_FORUMS, MALFORMED_NUM_IN_HOUSE])
+        self.assertEqual(errorMessages(codes)[0], 'Missing email address')
+
+
+class MetaRulesTest(unittest.TestCase):
+
+    def testMetaRules(self):
+        valid = {'staffemail': 'staff@example.com', 'eventdate': '1/15/2013'}
+        self.assertEqual(validateDict(valid, meta_rules), [])
+        self.assertEqual(validateDict({'eventdate': '2013-01-15'},
+                                      meta_rules),
+                         [MISSING_STAFF_EMAIL, MALFORMED_EVENT_DATE])
+        self.assertEqual(validateDict({'staffemail': 'staff'}, meta_rules),
+                         [MALFORMED_STAFF_EMAIL])
+
+
+class ColumnsTest(unittest.TestCase):
+    """ Rows are validated a whole column at a time"""
+
+    def testColumnVector(self):
+        columns = {'forum2': ('b', None, None), 'forum1': (None, 'a', None),
+                   'email': ('x', 'y', 'z')}
+        self.assertEqual(columnVector(columns, 'forum*', 3), ['b', 'a', None])
+        self.assertEqual(columnVector(columns, 'email', 3), ('x', 'y', 'z'))
+        self.assertEqual(columnVector(columns, 'inhouse', 3),
+                         (None, None, None))
+        self.assertEqual(columnVector({}, 'forum*', 2), (None, None))
+
+    def testValidateColumns(self):
+        rows = [person(), person(email='ada'), person(forum1=None)]
+        columns = dict((name, [row[name] for row in rows])
+                       for name in rows[0])
+        self.assertEqual(validateColumns(columns),
+                         [[], [MALFORMED_EMAIL], [NO_FORUMS]])
+        self.assertEqual(validateColumns(columns),
+                         [validateDict(row) for row in rows])
+        self.assertEqual(validateColumns({}), [])
+
+
+class PreflightCsvTest(unittest.TestCase):
+    """ Exported Raw sheets are validated offline like on Google Drive"""
+
+    def testPreflight(self):
+        csv_file = StringIO(
+            'Signup sheet,,,,,\n'
+            'Email,First Name,Last Name,Full Name,Forum 1,In House\n'
+            'ada@example.com,Ada,Lovelace,Ada Lovelace,Saint Paul,2\n'
+            'ada,Ada,Lovelace,Ada Lovelace,,x\n'
+            ',,, ,,\n'
+            'jose@example.com,Jose,,Jose ,Ward 1\n'
+            '\n'
+            'after@example.com,,,,,\n')
+        self.assertEqual(preflightCsv(csv_file), [
+            (4, [MALFORMED_EMAIL, NO_FORUMS, MALFORMED_NUM_IN_HOUSE]),
+            (6, [MISSING_LAST_NAME])])
+
+    def testNoHeaderRow(self):
+        csv_file = StringIO('a,b\n' * 20)
+        self.assertRaises(LookupError, preflightCsv, csv_file)
+
+    def testMain(self):
+        fd, path = tempfile.mkstemp(suffix='.csv')
+        with os.fdopen(fd, 'wb') as csv_file:
+            csv_file.write('Email,First Name,Last Name,Full Name,Forum\n'
+                           'ada,Ada,Lovelace,Ada Lovelace,Saint Paul\n')
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            self.assertEqual(validation.main([path]), 1)
+            self.assertEqual(sys.stdout.getvalue(),
+                             '%s:2: Malformed email address\n' % path)
+        finally:
+            sys.stdout = stdout
+            os.remove(path)
+
+
+if __name__ == '__main__':
+    unittest.main()
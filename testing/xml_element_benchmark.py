@@ -0,0 +1,165 @@
+"""
+Microbenchmark of the atom.core XmlElement lookups used when reading list
+feeds. Run from the repository root with:
+
+    python testing/xml_element_benchmark.py [rows] [columns]
+
+Times qname matching and element lookups on a synthetic list feed, comparing
+the cached, pre-split qnames of atom.core against the original string parsing,
+compares the size and construction time of compact elements against
+elements with an instance __dict__, and compares writing a batch cells feed
+directly against converting it to an ElementTree first.
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'lib'))
+
+import atom.core
+import atom.data
+import gdata.spreadsheets.data
+
+ATOM = 'http://www.w3.org/2005/Atom'
+GSX = gdata.spreadsheets.data.GSX_NAMESPACE
+
+
+def unsplit_qname_matches(tag, namespace, qname):
+    """ atom.core._qname_matches before qnames were split once and cached"""
+    if qname is None:
+        member_tag = None
+        member_namespace = None
+    else:
+        if qname.startswith('{'):
+            member_namespace = qname[1:qname.index('}')]
+            member_tag = qname[qname.index('}') + 1:]
+        else:
+            member_namespace = None
+            member_tag = qname
+    return ((tag is None and namespace is None)
+            or (namespace is None and member_tag == tag)
+            or (tag is None and member_namespace == namespace)
+            or (tag is None and namespace == '' and member_namespace is None)
+            or (tag == member_tag and namespace == member_namespace)
+            or (tag == member_tag and namespace == ''
+                and member_namespace is None))
+
+
+def unindexed_get_elements(element, tag=None, namespace=None):
+    """ XmlElement.get_elements before _other_elements were indexed"""
+    matches = []
+    ignored1, elements, ignored2 = element.__class__._get_rules(1)
+    for qname, element_def in elements.iteritems():
+        member = getattr(element, element_def[0])
+        if member and unsplit_qname_matches(tag, namespace, qname):
+            if element_def[2]:
+                matches.extend(member)
+            else:
+                matches.append(member)
+    for other in element._other_elements:
+        if unsplit_qname_matches(tag, namespace, other._qname):
+            matches.append(other)
+    return matches
+
+
+class PlainLink(atom.core.XmlElement):
+    """ atom.data.Link without the compact element mode"""
+    _qname = atom.data.Link._qname
+    href = 'href'
+    rel = 'rel'
+    type = 'type'
+    hreflang = 'hreflang'
+    title = 'title'
+    length = 'length'
+
+
+def element_size(element):
+    """ The bytes taken by an element and the containers it owns"""
+    size = sys.getsizeof(element)
+    if getattr(element, '__dict__', None):
+        size += sys.getsizeof(element.__dict__)
+    if element._other_elements.__class__ is list:
+        size += sys.getsizeof(element._other_elements)
+    if element._other_attributes is not atom.core._EMPTY_ATTRIBUTES:
+        size += sys.getsizeof(element._other_attributes)
+    return size
+
+
+def list_feed(rows, columns):
+    entries = []
+    for row in range(rows):
+        cells = ''.join('<gsx:column%s>value %s %s</gsx:column%s>' %
+                        (column, row, column, column)
+                        for column in range(columns))
+        entries.append(
+            '<entry><id>https://spreadsheets.google.com/row%s</id>'
+            '<updated>2013-01-01T00:00:00.000Z</updated>'
+            '<link rel="self" href="https://example.com/%s"/>'
+            '<link rel="edit" href="https://example.com/%s/edit"/>'
+            '%s</entry>' % (row, row, row, cells))
+    return ('<feed xmlns="%s" xmlns:gsx="%s"><id>feed</id>%s</feed>' %
+            (ATOM, GSX, ''.join(entries)))
+
+
+def compare(name, old, new, number):
+    old_time = min(timeit.repeat(old, number=number, repeat=3))
+    new_time = min(timeit.repeat(new, number=number, repeat=3))
+    print '%-28s %8.3fs %8.3fs %6.1fx' % (name, old_time, new_time,
+                                         old_time / new_time)
+
+
+def main(rows=1000, columns=30):
+    feed = atom.core.parse(list_feed(rows, columns),
+                           gdata.spreadsheets.data.ListsFeed)
+    entries = feed.entry
+    qnames = [other._qname for entry in entries[:50]
+              for other in entry._other_elements]
+    last_column = 'column%s' % (columns - 1)
+
+    print '%s rows x %s columns' % (rows, columns)
+    print '%-28s %9s %9s %7s' % ('', 'original', 'cached', 'speedup')
+    compare('_qname_matches',
+            lambda: [unsplit_qname_matches(last_column, GSX, qname)
+                     for qname in qnames],
+            lambda: [atom.core._qname_matches(last_column, GSX, qname)
+                     for qname in qnames],
+            20)
+    compare('get_elements(tag, ns)',
+            lambda: [unindexed_get_elements(entry, last_column, GSX)
+                     for entry in entries],
+            lambda: [entry.get_elements(last_column, GSX)
+                     for entry in entries],
+            1)
+    compare('get_elements(ns)',
+            lambda: [unindexed_get_elements(entry, None, GSX)
+                     for entry in entries],
+            lambda: [entry.get_elements(None, GSX) for entry in entries],
+            1)
+
+    print
+    print '%-28s %9s %9s %7s' % ('', 'dict', 'compact', 'ratio')
+    plain, link = PlainLink(href='h', rel='r'), atom.data.Link(href='h', rel='r')
+    print '%-28s %8sB %8sB %6.1fx' % ('Link size', element_size(plain),
+                                      element_size(link),
+                                      float(element_size(plain)) /
+                                      element_size(link))
+    compare('Link construction',
+            lambda: [PlainLink(href='h', rel='r') for i in xrange(rows)],
+            lambda: [atom.data.Link(href='h', rel='r') for i in xrange(rows)],
+            20)
+
+    print
+    print '%-28s %9s %9s %7s' % ('', 'tree', 'direct', 'speedup')
+    batch = gdata.spreadsheets.data.BuildBatchCellsUpdate('key', 'od6')
+    for row in range(rows):
+        for column in range(columns):
+            batch.add_set_cell(row + 1, column + 1, 'value %s' % column)
+    compare('batch feed to_string',
+            lambda: atom.core.ElementTree.tostring(batch._to_tree(1)),
+            lambda: batch.to_string(1),
+            1)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,351 @@
+# coding=utf-8
+"""
+Round trip tests of the atom.core XmlElement changes: the qname caches, the
+compact elements of list feed rows and cells, and the XML writer. Run from
+the repository root with:
+
+    python testing/xml_element_test.py
+"""
+import copy
+import cPickle
+import os
+import pickle
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'lib'))
+
+import atom.core
+import gdata.docs.data
+import gdata.spreadsheets.data
+import gdata.test_data
+from xml.etree import cElementTree as ElementTree
+
+GSX = gdata.spreadsheets.data.GSX_NAMESPACE
+
+# A list feed of a Raw sheet, as returned by the Spreadsheets API
+LIST_FEED = """<?xml version='1.0' encoding='UTF-8'?>
+<feed xmlns='http://www.w3.org/2005/Atom'
+    xmlns:openSearch='http://a9.com/-/spec/opensearch/1.1/'
+    xmlns:gsx='http://schemas.google.com/spreadsheets/2006/extended'
+    xmlns:gd='http://schemas.google.com/g/2005'
+    gd:etag='W/"D0cERnk-eip7ImA9WBBXGEg."'>
+  <id>https://spreadsheets.google.com/feeds/list/key/od6/private/full</id>
+  <updated>2013-01-15T18:24:45.491Z</updated>
+  <category scheme='http://schemas.google.com/spreadsheets/2006'
+      term='http://schemas.google.com/spreadsheets/2006#list'/>
+  <title type='text'>Raw</title>
+  <link rel='http://schemas.google.com/g/2005#post'
+      type='application/atom+xml'
+      href='https://spreadsheets.google.com/feeds/list/key/od6/private/full'/>
+  <openSearch:totalResults>2</openSearch:totalResults>
+  <openSearch:startIndex>1</openSearch:startIndex>
+  <entry gd:etag='"S0wCTlpIIip7ImA0X0QI"'>
+    <id>https://spreadsheets.google.com/feeds/list/key/od6/private/full/cokwr</id>
+    <updated>2013-01-15T18:24:45.491Z</updated>
+    <category scheme='http://schemas.google.com/spreadsheets/2006'
+        term='http://schemas.google.com/spreadsheets/2006#list'/>
+    <title type='text'>ada@example.com</title>
+    <content type='text'>firstname: Ada, lastname: Lovelace</content>
+    <link rel='self' type='application/atom+xml'
+        href='https://spreadsheets.google.com/feeds/list/key/od6/private/full/cokwr'/>
+    <link rel='edit' type='application/atom+xml'
+        href='https://spreadsheets.google.com/feeds/list/key/od6/private/full/cokwr/1'/>
+    <gsx:email>ada@example.com</gsx:email>
+    <gsx:firstname>Ada</gsx:firstname>
+    <gsx:lastname>Lovelace</gsx:lastname>
+    <gsx:city>Saint Paul</gsx:city>
+  </entry>
+  <entry gd:etag='"AxQDSXxjfyp7ImA0ChJVSBI."'>
+    <id>https://spreadsheets.google.com/feeds/list/key/od6/private/full/cpzh4</id>
+    <updated>2013-01-15T18:24:45.491Z</updated>
+    <category scheme='http://schemas.google.com/spreadsheets/2006'
+        term='http://schemas.google.com/spreadsheets/2006#list'/>
+    <title type='text'>jose@example.com</title>
+    <content type='text'>firstname: José, lastname: Martí &amp; Pérez</content>
+    <link rel='self' type='application/atom+xml'
+        href='https://spreadsheets.google.com/feeds/list/key/od6/private/full/cpzh4'/>
+    <link rel='edit' type='application/atom+xml'
+        href='https://spreadsheets.google.com/feeds/list/key/od6/private/full/cpzh4/1'/>
+    <gsx:email>jose@example.com</gsx:email>
+    <gsx:firstname>José</gsx:firstname>
+    <gsx:lastname>Martí &amp; Pérez</gsx:lastname>
+    <gsx:city></gsx:city>
+  </entry>
+</feed>"""
+
+# A cells feed of the header and first row of a Raw sheet
+CELLS_FEED = """<?xml version='1.0' encoding='UTF-8'?>
+<feed xmlns='http://www.w3.org/2005/Atom'
+    xmlns:openSearch='http://a9.com/-/spec/opensearch/1.1/'
+    xmlns:batch='http://schemas.google.com/gdata/batch'
+    xmlns:gs='http://schemas.google.com/spreadsheets/2006'>
+  <id>https://spreadsheets.google.com/feeds/cells/key/od6/private/full</id>
+  <updated>2013-01-15T18:24:45.491Z</updated>
+  <category scheme='http://schemas.google.com/spreadsheets/2006'
+      term='http://schemas.google.com/spreadsheets/2006#cell'/>
+  <title type='text'>Raw</title>
+  <link rel='http://schemas.google.com/g/2005#batch'
+      type='application/atom+xml'
+      href='https://spreadsheets.google.com/feeds/cells/key/od6/private/full/batch'/>
+  <openSearch:totalResults>4</openSearch:totalResults>
+  <gs:rowCount>100</gs:rowCount>
+  <gs:colCount>20</gs:colCount>
+  <entry>
+    <id>https://spreadsheets.google.com/feeds/cells/key/od6/private/full/R1C1</id>
+    <updated>2013-01-15T18:24:45.491Z</updated>
+    <title type='text'>A1</title>
+    <content type='text'>Email</content>
+    <link rel='self' type='application/atom+xml'
+        href='https://spreadsheets.google.com/feeds/cells/key/od6/private/full/R1C1'/>
+    <link rel='edit' type='application/atom+xml'
+        href='https://spreadsheets.google.com/feeds/cells/key/od6/private/full/R1C1/1'/>
+    <gs:cell row='1' col='1' inputValue='Email'>Email</gs:cell>
+  </entry>
+  <entry>
+    <id>https://spreadsheets.google.com/feeds/cells/key/od6/private/full/R1C2</id>
+    <updated>2013-01-15T18:24:45.491Z</updated>
+    <title type='text'>B1</title>
+    <content type='text'>Inhouse</content>
+    <gs:cell row='1' col='2' inputValue='Inhouse'>Inhouse</gs:cell>
+  </entry>
+  <entry>
+    <id>https://spreadsheets.google.com/feeds/cells/key/od6/private/full/R2C1</id>
+    <updated>2013-01-15T18:24:45.491Z</updated>
+    <title type='text'>A2</title>
+    <content type='text'>jose@example.com</content>
+    <gs:cell row='2' col='1' inputValue='jose@example.com'>jose@example.com</gs:cell>
+  </entry>
+  <entry>
+    <id>https://spreadsheets.google.com/feeds/cells/key/od6/private/full/R2C2</id>
+    <updated>2013-01-15T18:24:45.491Z</updated>
+    <title type='text'>B2</title>
+    <content type='text'>4</content>
+    <gs:cell row='2' col='2' inputValue='=2+2' numericValue='4.0'>4</gs:cell>
+  </entry>
+</feed>"""
+
+
+def canonical(tree):
+    """ The parts of an ElementTree which do not depend on how its XML was
+    written, like the prefixes of its namespaces"""
+    return (tree.tag, sorted(tree.attrib.items()), tree.text or '',
+            [canonical(child) for child in tree])
+
+
+def parse_list_feed():
+    return atom.core.parse(LIST_FEED, gdata.spreadsheets.data.ListsFeed)
+
+
+def parse_cells_feed():
+    return atom.core.parse(CELLS_FEED, gdata.spreadsheets.data.CellsFeed)
+
+
+class QnameCacheTest(unittest.TestCase):
+    """ The caches of split and prefixed qnames stay bounded"""
+
+    def setUp(self):
+        self.max_cached_qnames = atom.core.MAX_CACHED_QNAMES
+        self.max_shared_prefixes = atom.core.MAX_SHARED_PREFIXES
+        atom.core.MAX_CACHED_QNAMES = 8
+
+    def tearDown(self):
+        atom.core.MAX_CACHED_QNAMES = self.max_cached_qnames
+        atom.core.MAX_SHARED_PREFIXES = self.max_shared_prefixes
+
+    def wideEntry(self, columns):
+        entry = gdata.spreadsheets.data.ListEntry()
+        for column in range(columns):
+            entry.set_value('column%s' % column, 'value %s' % column)
+        return entry
+
+    def testSplitQnamesAreBounded(self):
+        for column in range(100):
+            qname = '{%s}column%s' % (GSX, column)
+            self.assertEqual(atom.core._split_qname(qname),
+                             (GSX, 'column%s' % column))
+            self.assertTrue(len(atom.core._split_qnames) <=
+                            atom.core.MAX_CACHED_QNAMES)
+        self.assertEqual(atom.core._split_qname(None), (None, None))
+
+    def testPrefixedQnamesAreBounded(self):
+        entry = self.wideEntry(100)
+        xml = entry.to_string()
+        self.assertTrue(len(atom.core._prefixed_qnames) <=
+                        atom.core.MAX_CACHED_QNAMES)
+        parsed = atom.core.parse(xml, gdata.spreadsheets.data.ListEntry)
+        self.assertEqual(parsed.to_dict(), entry.to_dict())
+
+    def testLookupsAfterCachesAreCleared(self):
+        feed = parse_list_feed()
+        self.wideEntry(100).to_string()
+        entry = feed.entry[1]
+        self.assertEqual(entry.get_value('lastname'), u'Martí & Pérez')
+        self.assertEqual([element.text for element
+                          in entry.get_elements('email', GSX)],
+                         ['jose@example.com'])
+
+    def testNamespacesBeyondSharedPrefixes(self):
+        atom.core.MAX_SHARED_PREFIXES = len(atom.core._namespace_prefixes)
+        shared = dict(atom.core._namespace_prefixes)
+        entry = self.wideEntry(3)
+        for n in range(3):
+            element = atom.core.XmlElement(text='value %s' % n)
+            element._qname = '{urn:example:%s}extra' % n
+            entry._writable_other_elements().append(element)
+
+        xml = entry.to_string()
+        self.assertEqual(atom.core._namespace_prefixes, shared)
+        parsed = atom.core.parse(xml, gdata.spreadsheets.data.ListEntry)
+        self.assertEqual(parsed.to_dict(), entry.to_dict())
+        for n in range(3):
+            self.assertEqual(
+                [element.text for element in
+                 parsed.get_elements('extra', 'urn:example:%s' % n)],
+                ['value %s' % n])
+
+
+class CompactElementTest(unittest.TestCase):
+    """ Compact list rows and cells behave like other XmlElements"""
+
+    def assertSameXml(self, element, other):
+        self.assertEqual(element.to_string(), other.to_string())
+
+    def testRowsAndCellsAreCompact(self):
+        # Their text and members are kept in slots rather than a __dict__
+        row = parse_list_feed().entry[0]._other_elements[0]
+        self.assertEqual(row.text, 'ada@example.com')
+        self.assertEqual(vars(row), {})
+        cell = parse_cells_feed().entry[0].cell
+        self.assertEqual(cell.input_value, 'Email')
+        self.assertEqual(vars(cell), {})
+
+    def testListEntryValues(self):
+        entry = parse_list_feed().entry[1]
+        self.assertEqual(entry.get_value('email'), 'jose@example.com')
+        self.assertEqual(entry.get_value('city'), None)
+        self.assertEqual(entry.get_value('missing'), None)
+        self.assertEqual(entry.to_dict(),
+                         {'email': 'jose@example.com',
+                          'firstname': u'José',
+                          'lastname': u'Martí & Pérez',
+                          'city': None})
+
+        entry.set_value('city', 'Minneapolis')
+        entry.set_value('zip', '55401')
+        self.assertEqual(entry.get_value('city'), 'Minneapolis')
+        self.assertEqual(entry.get_value('zip'), '55401')
+        parsed = atom.core.parse(entry.to_string(),
+                                 gdata.spreadsheets.data.ListEntry)
+        self.assertEqual(parsed.to_dict(), entry.to_dict())
+
+    def testCellValues(self):
+        cell = parse_cells_feed().entry[3].cell
+        self.assertEqual((cell.row, cell.col), ('2', '2'))
+        self.assertEqual(cell.input_value, '=2+2')
+        self.assertEqual(cell.numeric_value, '4.0')
+        self.assertEqual(cell.text, '4')
+
+    def testSharedChildrenAreReadOnly(self):
+        cell = parse_cells_feed().entry[0].cell
+        self.assertRaises(TypeError, cell._other_elements.append,
+                          atom.core.XmlElement())
+        self.assertRaises(TypeError, cell._other_attributes.__setitem__,
+                          'a', 'b')
+        cell._writable_other_elements().append(atom.core.XmlElement())
+        cell._writable_other_attributes()['a'] = 'b'
+        self.assertEqual(len(cell._other_elements), 1)
+        self.assertEqual(cell._other_attributes, {'a': 'b'})
+        other_cell = parse_cells_feed().entry[0].cell
+        self.assertEqual(len(other_cell._other_elements), 0)
+        self.assertEqual(other_cell._other_attributes, {})
+
+    def testDeepcopy(self):
+        for feed in (parse_list_feed(), parse_cells_feed()):
+            copied = copy.deepcopy(feed)
+            self.assertSameXml(copied, feed)
+
+        feed = parse_list_feed()
+        copied = copy.deepcopy(feed)
+        copied.entry[0].set_value('city', 'Duluth')
+        self.assertEqual(feed.entry[0].get_value('city'), 'Saint Paul')
+        self.assertEqual(copied.entry[0].get_value('city'), 'Duluth')
+
+    def testPickle(self):
+        for module in (pickle, cPickle):
+            for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+                for feed in (parse_list_feed(), parse_cells_feed()):
+                    # Indexes built before pickling are pickled with it
+                    feed.entry[0].get_elements('email', GSX)
+                    loaded = module.loads(module.dumps(feed, protocol))
+                    self.assertSameXml(loaded, feed)
+
+                entry = module.loads(module.dumps(parse_list_feed(),
+                                                  protocol)).entry[1]
+                self.assertEqual(entry.get_value('firstname'), u'José')
+                entry.set_value('firstname', 'Jo')
+                self.assertEqual(entry.get_value('firstname'), 'Jo')
+                cell = module.loads(module.dumps(parse_cells_feed(),
+                                                 protocol)).entry[3].cell
+                self.assertEqual(cell.input_value, '=2+2')
+
+
+class XmlWriterTest(unittest.TestCase):
+    """ to_string and to_chunks write the XML that _to_tree builds"""
+
+    def feeds(self):
+        update = gdata.spreadsheets.data.BuildBatchCellsUpdate('key', 'od6')
+        update.AddSetCell(2, 1, 'ada@example.com')
+        update.AddSetCell(2, 2, u'Jos\xe9')
+        return [parse_list_feed(), parse_cells_feed(), update,
+                atom.core.parse(gdata.test_data.DOCUMENT_LIST_ACL_FEED,
+                                gdata.docs.data.AclFeed)]
+
+    def assertWritesTree(self, element):
+        written = ElementTree.fromstring(element.to_string())
+        built = ElementTree.fromstring(
+            ElementTree.tostring(element._to_tree(1)))
+        self.assertEqual(canonical(written), canonical(built))
+
+    def testFeedsMatchElementTree(self):
+        for feed in self.feeds():
+            self.assertWritesTree(feed)
+            for entry in feed.entry:
+                self.assertWritesTree(entry)
+
+    def testChangedElementsMatchElementTree(self):
+        feed = parse_list_feed()
+        feed.entry[0].set_value('city', u'Saint Paul & Ume\xe5 <MN>')
+        feed.entry[1].set_value('zip', '55401')
+        feed.entry[1]._writable_other_attributes()['note'] = ''
+        self.assertWritesTree(feed)
+
+    def testChunks(self):
+        large = parse_list_feed()
+        for n in range(200):
+            large.entry.append(copy.deepcopy(large.entry[n % 2]))
+        for feed in self.feeds() + [large]:
+            chunks = feed.to_chunks(chunk_size=4096)
+            self.assertEqual(''.join(chunks), feed.to_string())
+            for chunk in chunks:
+                chunk.decode('ascii')
+        self.assertTrue(len(large.to_chunks(chunk_size=4096)) > 1)
+        self.assertWritesTree(large)
+
+    def testOnlyWrittenNamespacesAreDeclared(self):
+        entry = parse_list_feed().entry[0]
+        entry.etag = None
+        root = entry.to_string().split('>', 1)[0]
+        self.assertTrue(GSX in root)
+        self.assertTrue('http://www.w3.org/2005/Atom' in root)
+        self.assertFalse('http://schemas.google.com/g/2005' in root)
+        self.assertFalse('opensearch' in root)
+        self.assertFalse('http://www.w3.org/2007/app' in root)
+        # Namespaces are only declared on the root
+        self.assertEqual(entry.to_string().count('xmlns:'),
+                         root.count('xmlns:'))
+
+
+if __name__ == '__main__':
+    unittest.main()